@@ -1,11 +1,17 @@
 """
 游戏基础任务类 - 提供3D MMORPG游戏的通用功能
 """
+import math
 import re
+import threading
 import time
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
 from enum import Enum
-from typing import Optional, Tuple, List
+from functools import lru_cache
+from typing import Optional, Tuple, List, Dict
+
+import cv2
 
 from ok import BaseTask
 from src.tasks.MyBaseTask import MyBaseTask
@@ -22,6 +28,42 @@ class GameState(Enum):
     INVENTORY_FULL = "full" # 背包满
 
 
+@dataclass
+class StatusSnapshot:
+    """同一帧上采样的角色状态"""
+    hp_pct: float       # 血量百分比
+    mp_pct: float       # 蓝量百分比
+    in_combat: bool     # 是否在战斗中
+    state: Optional[GameState] = None   # 游戏状态（仅 sample_player_status 填充）
+
+
+# 移动方向对应的按键
+MOVE_KEYS = {
+    'forward': 'w',
+    'backward': 's',
+    'left': 'a',
+    'right': 'd',
+}
+
+# OCR检测战斗状态用的文字匹配
+COMBAT_TEXT_PATTERN = re.compile(r'战斗|combat')
+
+
+@lru_cache(maxsize=64)
+def cached_compile(pattern: str) -> re.Pattern:
+    """编译正则并缓存，供需要反复按名称匹配OCR结果的地方使用"""
+    return re.compile(pattern)
+
+
+def _box_key(box) -> tuple:
+    """将区域配置转换为可哈希的缓存键"""
+    if box is None:
+        return ()
+    if isinstance(box, dict):
+        return tuple(sorted(box.items()))
+    return (box,)
+
+
 class BaseGameTask(MyBaseTask, ABC):
     """
     游戏基础任务类
@@ -49,11 +91,151 @@ class BaseGameTask(MyBaseTask, ABC):
             'y_end': 0.18     # 右上角小地图结束Y
         }
 
+        # 血条/蓝条区域（左上角角色头像旁，需根据游戏实际界面调整）
+        self.hp_bar_area = {
+            'x_start': 0.06,
+            'x_end': 0.20,
+            'y_start': 0.040,
+            'y_end': 0.050
+        }
+
+        self.mp_bar_area = {
+            'x_start': 0.06,
+            'x_end': 0.20,
+            'y_start': 0.055,
+            'y_end': 0.065
+        }
+        self._area_roi_cache = {}  # (区域, 分辨率) -> 像素切片坐标
+
+        # 非阻塞移动：方向 -> 松开按键的时间（monotonic）
+        self._active_moves: Dict[str, float] = {}
+
+        # 技能后摇结束时间（monotonic），期间不释放新技能
+        self._next_skill_ready = 0.0
+
+        # 小地图灰度缩小图：同一帧内所有小地图模板共用一份
+        self.minimap_scale = 0.5
+        self.minimap_threshold = 0.8
+        self._minimap_cache = {'frame': None, 'gray_small': None}
+        self._minimap_templates = {}  # (模板名, 分辨率宽度) -> 灰度缩小模板
+
         # 角色位置（角色在屏幕中心）
         self.character_center = (0.5, 0.5)
 
         # 当前游戏状态
         self.current_state = GameState.IDLE
+        self.state_ttl = 0.2                # 游戏状态缓存有效期（秒）
+        self._state_valid_until = 0.0
+        self.dead_screen_brightness = 80    # 死亡时画面变暗，平均亮度高于该值时跳过死亡检测
+
+        # 帧缓存：同一帧内的模板匹配结果复用，避免每次检测都重新截图匹配
+        self.frame_ttl = 0.08  # 缓存帧有效期（秒）
+        self._frame_cache = {'ts': 0.0, 'frame': None, 'matches': {}}
+
+        # 逐tick缓存：同一tick内的OCR文字只识别一次，sleep、点击、按键后进入下一tick
+        self._state_tick = 0
+        self._state_cache: Dict[str, Tuple[int, object]] = {}
+
+        # 停止请求：长时间等待会分段检查，收到请求后立即结束等待
+        self._stop_event = threading.Event()
+
+    # ==================== 帧缓存 ====================
+
+    def invalidate_frame_cache(self):
+        """清空帧缓存（点击、按键后画面会变化）"""
+        self._frame_cache['ts'] = 0.0
+        self._frame_cache['frame'] = None
+        self._frame_cache['matches'].clear()
+        self._state_valid_until = 0.0
+        self._state_tick += 1
+
+    def _cached_frame(self):
+        """获取缓存帧，超过有效期后重新获取"""
+        cache = self._frame_cache
+        now = time.monotonic()
+        if cache['frame'] is None or now - cache['ts'] >= self.frame_ttl:
+            cache['frame'] = self.frame
+            cache['ts'] = now
+            cache['matches'].clear()
+        return cache['frame']
+
+    def _cached_find_one(self, name: str, box=None, threshold: float = 0):
+        """
+        在缓存帧上查找模板，同一帧内相同查询直接返回缓存结果
+        :param name: 模板名称
+        :param box: 查找区域
+        :param threshold: 匹配阈值
+        """
+        frame = self._cached_frame()
+        matches = self._frame_cache['matches']
+        key = (name, _box_key(box), threshold)
+        if key not in matches:
+            matches[key] = self.find_one(name, box=box, threshold=threshold, frame=frame)
+        return matches[key]
+
+    def _box_center(self, box) -> Optional[Tuple[float, float]]:
+        """
+        将 find_one 返回的像素区域换算为中心点的全屏相对坐标
+        :param box: 查找结果，None表示未找到
+        """
+        frame = self._cached_frame()
+        if box is None or frame is None:
+            return None
+        height, width = frame.shape[:2]
+        return (box.x + box.width / 2) / width, (box.y + box.height / 2) / height
+
+    def _cached_ocr(self, match: re.Pattern, box=None):
+        """
+        在缓存帧上做OCR文字匹配，同一帧内相同查询直接返回缓存结果
+        :param match: 文字匹配正则
+        :param box: 识别区域
+        """
+        frame = self._cached_frame()
+        matches = self._frame_cache['matches']
+        key = ('ocr', match.pattern, _box_key(box))
+        if key not in matches:
+            matches[key] = self.ocr(box=box, match=match, frame=frame, log=False)
+        return matches[key]
+
+    def _cached(self, key: str, fn):
+        """
+        同一tick内复用检测结果，tick推进后重新计算
+        :param key: 缓存键
+        :param fn: 检测函数
+        """
+        hit = self._state_cache.get(key)
+        if hit is not None and hit[0] == self._state_tick:
+            return hit[1]
+        value = fn()
+        self._state_cache[key] = (self._state_tick, value)
+        return value
+
+    def prime_from(self, other: 'BaseGameTask'):
+        """
+        用另一个任务刚得到的检测结果预热本任务的缓存，子任务启动后首次检测不必重新截图匹配
+        :param other: 刚完成检测的任务（通常是父任务）
+        """
+        self._frame_cache['frame'] = other._frame_cache['frame']
+        self._frame_cache['ts'] = other._frame_cache['ts']
+        self._frame_cache['matches'] = dict(other._frame_cache['matches'])
+        self.current_state = other.current_state
+        self._state_valid_until = other._state_valid_until
+
+    def sleep(self, *args, **kwargs):
+        self._state_tick += 1
+        return super().sleep(*args, **kwargs)
+
+    def click(self, *args, **kwargs):
+        self.invalidate_frame_cache()
+        return super().click(*args, **kwargs)
+
+    def click_box(self, *args, **kwargs):
+        self.invalidate_frame_cache()
+        return super().click_box(*args, **kwargs)
+
+    def send_key(self, *args, **kwargs):
+        self.invalidate_frame_cache()
+        return super().send_key(*args, **kwargs)
 
     # ==================== 移动控制 ====================
 
@@ -106,9 +288,46 @@ class BaseGameTask(MyBaseTask, ABC):
 
     def do_stop_movement(self):
         """执行停止移动"""
+        self._active_moves.clear()
         for key in ['w', 'a', 's', 'd']:
             self.do_send_key_up(key)
 
+    def start_move(self, direction: str, duration: float):
+        """
+        开始向指定方向移动（不阻塞），到时间后由 _tick_movement 松开按键
+        :param direction: 方向（forward/backward/left/right）
+        :param duration: 持续时间（秒）
+        """
+        key = MOVE_KEYS[direction]
+        if direction not in self._active_moves:
+            self.operate(lambda: self.do_send_key_down(key))
+        self._active_moves[direction] = time.monotonic() + duration
+
+    def stop_move(self, direction: str):
+        """停止指定方向的非阻塞移动"""
+        if self._active_moves.pop(direction, None) is not None:
+            key = MOVE_KEYS[direction]
+            self.operate(lambda: self.do_send_key_up(key))
+
+    def stop_all_moves(self):
+        """停止所有非阻塞移动"""
+        for direction in list(self._active_moves):
+            self.stop_move(direction)
+
+    def _tick_movement(self):
+        """松开已到时间的移动按键，主循环每次迭代调用"""
+        if not self._active_moves:
+            return
+        now = time.monotonic()
+        for direction, end_time in list(self._active_moves.items()):
+            if now >= end_time:
+                self.stop_move(direction)
+
+    @property
+    def is_moving(self) -> bool:
+        """是否有未结束的非阻塞移动"""
+        return bool(self._active_moves)
+
     def jump(self):
         """跳跃"""
         self.operate(lambda: self.send_key('space'))
@@ -136,31 +355,101 @@ class BaseGameTask(MyBaseTask, ABC):
         可以通过检测血条、战斗UI、怒气条等判断
         """
         # 方式1: 检测血条出现
-        if self.check_exists('combat_hp_bar', threshold=0.7):
+        if self._cached_find_one('combat_hp_bar', threshold=0.7) is not None:
             return True
 
         # 方式2: OCR检测"战斗中"文字
-        # if self.ocr(match=re.compile(r'战斗|combat'), log=False):
+        # if self.ocr(match=COMBAT_TEXT_PATTERN, log=False):
         #     return True
 
         return False
 
+    def get_hp_percent(self, frame=None) -> float:
+        """
+        获取血量百分比（红色血条）
+        :param frame: 截图，为None时使用缓存帧
+        """
+        return self._bar_fill_percent(frame, self.hp_bar_area, channel=2)
+
+    def get_mp_percent(self, frame=None) -> float:
+        """
+        获取蓝量百分比（蓝色蓝条）
+        :param frame: 截图，为None时使用缓存帧
+        """
+        return self._bar_fill_percent(frame, self.mp_bar_area, channel=0)
+
+    def _area_roi(self, area: dict, frame) -> Tuple[int, int, int, int]:
+        """将相对区域换算为像素坐标 (y0, y1, x0, x1)，按分辨率缓存"""
+        height, width = frame.shape[:2]
+        key = (_box_key(area), height, width)
+        roi = self._area_roi_cache.get(key)
+        if roi is None:
+            roi = (int(area['y_start'] * height), int(area['y_end'] * height),
+                   int(area['x_start'] * width), int(area['x_end'] * width))
+            self._area_roi_cache[key] = roi
+        return roi
+
+    def _bar_fill_percent(self, frame, area: dict, channel: int) -> float:
+        """
+        计算状态条填充百分比
+        状态条是一条横向色带，逐列判断是否存在该颜色的像素，有颜色的列占比即填充率
+        区域内完全没有状态条颜色时（区域未校准、被界面遮挡、加载画面等）无法判断，按满值返回，
+        避免误判为低血量/低蓝量而反复吃药；死亡由 check_game_state 单独检测
+        :param frame: 截图（BGR），为None时使用缓存帧
+        :param area: 状态条区域
+        :param channel: 状态条主色通道（0=蓝, 2=红）
+        """
+        if frame is None:
+            frame = self._cached_frame()
+        if frame is None:
+            return 100.0
+
+        y0, y1, x0, x1 = self._area_roi(area, frame)
+        bar = frame[y0:y1, x0:x1]
+        if bar.size == 0:
+            return 100.0
+
+        # 主色通道亮，其余两个通道暗
+        mask = bar[:, :, channel] > 150
+        for other in (0, 1, 2):
+            if other != channel:
+                mask &= bar[:, :, other] < 80
+        filled = mask.any(axis=0).sum()
+        if filled == 0:
+            return 100.0
+        return filled * 100.0 / mask.shape[1]
+
     def check_hp_low(self, threshold_percent: float = 30.0) -> bool:
         """
         检测血量是否低于阈值
         :param threshold_percent: 血量百分比阈值
         """
-        # TODO: 实现血量检测逻辑
-        # 可以通过识别血条的长度比例来判断
-        return False
+        return self.get_hp_percent() < threshold_percent
 
     def check_mp_low(self, threshold_percent: float = 20.0) -> bool:
         """
         检测蓝量是否低于阈值
         :param threshold_percent: 蓝量百分比阈值
         """
-        # TODO: 实现蓝量检测逻辑
-        return False
+        return self.get_mp_percent() < threshold_percent
+
+    def _sample_status(self) -> StatusSnapshot:
+        """在同一帧上一次性采样血量、蓝量和战斗状态"""
+        frame = self._cached_frame()
+        return StatusSnapshot(
+            hp_pct=self.get_hp_percent(frame),
+            mp_pct=self.get_mp_percent(frame),
+            in_combat=self.is_in_combat()
+        )
+
+    def sample_player_status(self) -> StatusSnapshot:
+        """
+        一次截图同时得到游戏状态、血量、蓝量和战斗状态
+        所有检测都在同一缓存帧上完成
+        """
+        snap = self._sample_status()
+        snap.state = self.check_game_state()
+        return snap
 
     # ==================== 小地图导航 ====================
 
@@ -177,16 +466,63 @@ class BaseGameTask(MyBaseTask, ABC):
         :return: 返回目标在小地图上的相对位置，如果未找到返回None
         """
         # 在小地图区域内查找目标标记
-        result = self.find_one(
-            target_name,
-            box={
-                'x_start': self.minimap_area['x_start'],
-                'x_end': self.minimap_area['x_end'],
-                'y_start': self.minimap_area['y_start'],
-                'y_end': self.minimap_area['y_end']
-            }
-        )
-        return result
+        template = self._minimap_template(target_name)
+        if template is None:
+            # 取不到模板时退回框架的区域查找，结果同样换算为全屏相对坐标
+            return self._box_center(self._cached_find_one(target_name, box=self.minimap_area))
+
+        minimap = self._minimap_gray_small()
+        if minimap is None:
+            return None
+        template_h, template_w = template.shape[:2]
+        if minimap.shape[0] < template_h or minimap.shape[1] < template_w:
+            return None
+
+        result = cv2.matchTemplate(minimap, template, cv2.TM_CCOEFF_NORMED)
+        _, max_val, _, max_loc = cv2.minMaxLoc(result)
+        if max_val < self.minimap_threshold:
+            return None
+
+        # 缩小图坐标 -> 小地图像素坐标 -> 全屏相对坐标
+        frame = self._minimap_cache['frame']
+        height, width = frame.shape[:2]
+        y0, _, x0, _ = self._area_roi(self.minimap_area, frame)
+        x = (x0 + (max_loc[0] + template_w / 2) / self.minimap_scale) / width
+        y = (y0 + (max_loc[1] + template_h / 2) / self.minimap_scale) / height
+        return x, y
+
+    def _minimap_gray_small(self):
+        """获取当前帧的小地图灰度缩小图，同一帧只生成一次"""
+        frame = self._cached_frame()
+        if frame is None:
+            return None
+        cache = self._minimap_cache
+        if cache['frame'] is not frame:
+            y0, y1, x0, x1 = self._area_roi(self.minimap_area, frame)
+            gray = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+            cache['gray_small'] = cv2.resize(gray, None, fx=self.minimap_scale, fy=self.minimap_scale,
+                                             interpolation=cv2.INTER_AREA)
+            cache['frame'] = frame
+        return cache['gray_small']
+
+    def _minimap_template(self, target_name: str):
+        """获取灰度缩小后的小地图模板（按分辨率缓存）"""
+        frame = self._cached_frame()
+        if frame is None:
+            return None
+        key = (target_name, frame.shape[1])
+        template = self._minimap_templates.get(key)
+        if template is None:
+            feature = self.get_feature_by_name(target_name)
+            if feature is None:
+                return None
+            template = feature.mat
+            if template.ndim == 3:
+                template = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
+            template = cv2.resize(template, None, fx=self.minimap_scale, fy=self.minimap_scale,
+                                  interpolation=cv2.INTER_AREA)
+            self._minimap_templates[key] = template
+        return template
 
     def navigate_to_minimap_target(self, target_name: str) -> bool:
         """
@@ -206,11 +542,8 @@ class BaseGameTask(MyBaseTask, ABC):
 
         # 调整视角朝向目标
         if abs(dx) > 0.02:  # 如果偏移量足够大
-            # 调整摄像机
-            if dx > 0:
-                self.adjust_camera(15)  # 向右转
-            else:
-                self.adjust_camera(-15)  # 向左转
+            # 调整摄像机（dx为正向右转，为负向左转）
+            self.adjust_camera(math.copysign(15.0, dx))
             self.sleep(0.3)
 
         # 向前移动
@@ -242,27 +575,33 @@ class BaseGameTask(MyBaseTask, ABC):
         """
         # 在任务列表区域使用OCR查找任务名称
         result = self.ocr(
-            box={
-                'x_start': self.quest_list_area['x_start'],
-                'x_end': self.quest_list_area['x_end'],
-                'y_start': self.quest_list_area['y_start'],
-                'y_end': self.quest_list_area['y_end']
-            },
-            match=re.compile(quest_name),
+            box=self.quest_list_area,
+            match=cached_compile(quest_name),
             log=True
         )
         return result is not None
 
     # ==================== 技能释放 ====================
 
-    def cast_skill(self, skill_key: str):
+    def cast_skill(self, skill_key: str, cooldown: float = 0.3) -> bool:
         """
-        释放技能
+        释放技能（不阻塞）
         :param skill_key: 技能按键（如 '1', '2', '3', 'q', 'e', 'r'）
+        :param cooldown: 技能后摇（秒），后摇期间不会释放其他技能
+        :return: 是否释放成功，上一个技能后摇未结束时返回False
         """
+        if time.monotonic() < self._next_skill_ready:
+            return False
         self.operate(lambda: self.send_key(skill_key))
         self.log_debug(f"释放技能: {skill_key}")
-        self.sleep(0.3)  # 技能后摇
+        self._next_skill_ready = time.monotonic() + cooldown
+        return True
+
+    def wait_skill_ready(self):
+        """等待上一个技能后摇结束"""
+        remaining = self._next_skill_ready - time.monotonic()
+        if remaining > 0:
+            self.sleep(remaining)
 
     def cast_skill_sequence(self, skill_keys: List[str]):
         """
@@ -270,8 +609,8 @@ class BaseGameTask(MyBaseTask, ABC):
         :param skill_keys: 技能按键列表
         """
         for skill_key in skill_keys:
+            self.wait_skill_ready()
             self.cast_skill(skill_key)
-            self.sleep(0.5)
 
     # ==================== 交互操作 ====================
 
@@ -294,28 +633,109 @@ class BaseGameTask(MyBaseTask, ABC):
         检测当前游戏状态
         :return: 游戏状态
         """
+        # 短时间内重复调用直接返回上次结果
+        if time.monotonic() < self._state_valid_until:
+            return self.current_state
+
         # 优先级检测：死亡 > 战斗 > 其他
-        if self.check_exists('dead_indicator', threshold=0.8):
+        # 死亡检测只在画面变暗时进行，正常画面直接跳过这次模板匹配
+        if self._is_screen_dimmed() and self._cached_find_one('dead_indicator', threshold=0.8) is not None:
             self.current_state = GameState.DEAD
         elif self.is_in_combat():
             self.current_state = GameState.IN_COMBAT
         else:
             self.current_state = GameState.IDLE
 
+        self._state_valid_until = time.monotonic() + self.state_ttl
         return self.current_state
 
+    def _is_screen_dimmed(self) -> bool:
+        """画面平均亮度是否低于死亡画面阈值（隔行隔列采样）"""
+        frame = self._cached_frame()
+        if frame is None:
+            return True
+        return frame[::4, ::4].mean() < self.dead_screen_brightness
+
     def wait_until_out_of_combat(self, timeout: float = 30.0) -> bool:
         """
         等待脱离战斗状态
         :param timeout: 超时时间（秒）
         :return: 是否成功脱离战斗
         """
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            if not self.is_in_combat():
+        return self.wait_with_backoff(
+            lambda: not self.is_in_combat() and self._confirm_not_in_combat(frames=2),
+            timeout=timeout
+        )
+
+    def _confirm_not_in_combat(self, frames: int = 2) -> bool:
+        """
+        连续多帧确认已脱离战斗，避免血条闪烁造成误判
+        :param frames: 需要连续检测不到战斗的帧数（含调用前已检测的一帧）
+        """
+        for _ in range(frames - 1):
+            self.sleep(0.1)
+            if self.is_in_combat():
+                return False
+        return True
+
+    def wait_with_backoff(self, predicate, timeout: float,
+                          initial_delay: float = 0.25, max_delay: float = 2.0) -> bool:
+        """
+        自适应退避等待：条件满足立即返回，未满足时检测间隔逐渐增大
+        :param predicate: 检测条件
+        :param timeout: 超时时间（秒）
+        :param initial_delay: 初始检测间隔（秒）
+        :param max_delay: 最大检测间隔（秒）
+        :return: 是否在超时前满足条件
+        """
+        deadline = time.monotonic() + timeout
+        delay = initial_delay
+        while True:
+            if predicate():
                 return True
-            self.sleep(1)
-        return False
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self.sleep(min(delay, remaining))
+            delay = min(delay * 1.5, max_delay)
+
+    def _wait_with_status_monitor(self, duration: float, hp_threshold: float, on_hp_low,
+                                  mp_threshold: Optional[float] = None, on_mp_low=None,
+                                  interval: float = 0.5) -> bool:
+        """
+        空闲等待期间持续监控血量和蓝量，低于阈值时立即处理，不用等到下一轮
+        收到停止请求时立即结束等待
+        :param duration: 等待时长（秒）
+        :param hp_threshold: 血量百分比阈值
+        :param on_hp_low: 血量过低时的处理
+        :param mp_threshold: 蓝量百分比阈值，None表示不监控蓝量
+        :param on_mp_low: 蓝量过低时的处理
+        :param interval: 检测间隔（秒）
+        :return: 是否因停止请求提前结束
+        """
+        deadline = time.monotonic() + duration
+        while True:
+            if self._stop_event.is_set():
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            frame = self._cached_frame()
+            if self.get_hp_percent(frame) < hp_threshold:
+                on_hp_low()
+            if on_mp_low is not None and mp_threshold is not None \
+                    and self.get_mp_percent(frame) < mp_threshold:
+                on_mp_low()
+            self.sleep(min(interval, remaining))
+
+    def request_stop(self):
+        """请求停止任务，正在进行的循环等待会立即结束"""
+        self._stop_event.set()
+
+    def disable(self):
+        """框架停止/禁用任务时同时发出停止请求，子任务和任务链也随之结束"""
+        self.request_stop()
+        return super().disable()
 
     # ==================== 抽象方法 ====================
 
@@ -1,15 +1,18 @@
 """
 战斗任务模块 - 自动战斗系统
 """
+import random
 import re
 import time
-from typing import List, Dict, Optional, Callable
+from typing import List, Dict, Optional, Callable, Tuple
+
+import cv2
 from dataclasses import dataclass
 from enum import Enum
 
 from qfluentwidgets import FluentIcon
 
-from src.tasks.BaseGameTask import BaseGameTask, GameState
+from src.tasks.BaseGameTask import BaseGameTask, GameState, StatusSnapshot
 from src.tasks.QuestManager import QuestManager, QuestConfig, QuestTask, TaskType
 
 
@@ -35,7 +38,7 @@ class SkillConfig:
     name: str                   # 技能名称
     priority: SkillPriority     # 优先级
     cooldown: float = 0.0       # 冷却时间（秒）
-    last_used: float = 0.0      # 上次使用时间
+    last_used: float = float('-inf')  # 上次使用时间（time.monotonic()时间戳）
     condition: Optional[Callable[[], bool]] = None  # 使用条件
     mp_cost: int = 0            # 蓝量消耗
 
@@ -62,6 +65,14 @@ class CombatTask(BaseGameTask):
     5. 战斗统计
     """
 
+    # 目标敌人选择 -> 敌人类型
+    _ENEMY_TYPE_MAP: Dict[str, Tuple[str, ...]] = {
+        '所有': ('普通怪', '精英怪'),
+        '精英怪': ('精英怪',),
+        'Boss': ('Boss',),
+    }
+    _DEFAULT_ENEMY_TYPES: Tuple[str, ...] = ('普通怪',)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.name = "战斗任务"
@@ -100,6 +111,8 @@ class CombatTask(BaseGameTask):
 
         # 技能配置
         self.skills: List[SkillConfig] = []
+        self._skills_by_priority: Tuple[SkillConfig, ...] = ()  # 按优先级排好序的技能
+        self._burst_skills: Tuple[SkillConfig, ...] = ()        # 高优先级（爆发）技能
 
         # 敌人配置
         self.enemy_configs: Dict[str, EnemyTarget] = {
@@ -126,6 +139,24 @@ class CombatTask(BaseGameTask):
             ),
         }
 
+        # 敌人扫描顺序（按优先级从高到低），Boss在该半径（平方）内时直接锁定
+        self._sorted_enemy_configs: List[Tuple[str, EnemyTarget]] = []
+        self._boss_ids: Tuple[str, ...] = ()
+        self._last_enemy_type: Optional[str] = None
+        self.boss_lock_radius_sq = 0.04
+        self._refresh_enemy_order()
+
+        # 敌人搜索区域（屏幕中央），只在该区域内做模板匹配
+        self.combat_viewport = {
+            'x_start': 0.2,
+            'x_end': 0.8,
+            'y_start': 0.2,
+            'y_end': 0.8
+        }
+        self.enemy_match_threshold = 0.8
+        self._viewport_cache = {'frame': None, 'gray': None}  # 同一帧只裁剪一次搜索区域
+        self._enemy_templates = {}  # (敌人ID, 分辨率宽度) -> 灰度模板
+
         # 战斗统计
         self.combat_stats = {
             'total_kills': 0,
@@ -139,6 +170,17 @@ class CombatTask(BaseGameTask):
         self.in_combat = False
         self.current_target = None
 
+        # 药品快捷键（run()开始时从配置读取一次）
+        self._hp_potion_key = '0'
+        self._mp_potion_key = '9'
+
+        # 战斗循环节拍（秒），按截止时间等待，避免检测耗时累积成漂移
+        self._combat_tick_period = 0.5
+
+        # 刷怪移动用的随机数生成器
+        self._rng = random.Random()
+        self._farm_directions = ('left', 'right', 'forward')
+
     def run(self):
         """任务执行入口"""
         self.log_info('战斗任务开始', notify=True)
@@ -155,6 +197,7 @@ class CombatTask(BaseGameTask):
         try:
             # 解析技能配置
             self._parse_skill_config()
+            self._refresh_enemy_order()
 
             # 获取配置
             combat_mode = CombatMode(self.config.get('战斗模式', 'auto'))
@@ -165,6 +208,9 @@ class CombatTask(BaseGameTask):
 
             hp_threshold = self.config.get('血量低于%使用血药', 30)
             mp_threshold = self.config.get('蓝量低于%使用蓝药', 20)
+            stop_when_full = self.config.get('背包满自动停止', False)
+            self._hp_potion_key = self.config.get('血药快捷键', '0')
+            self._mp_potion_key = self.config.get('蓝药快捷键', '9')
 
             # 构建战斗任务链
             quest = self._build_combat_quest(combat_mode, target_selection, combat_count)
@@ -188,7 +234,7 @@ class CombatTask(BaseGameTask):
                     continue
 
                 # 检查背包
-                if self.config.get('背包满自动停止', False):
+                if stop_when_full:
                     # TODO: 实现背包满检测
                     pass
 
@@ -211,6 +257,7 @@ class CombatTask(BaseGameTask):
             self.log_error(f"战斗任务异常: {e}")
             raise
         finally:
+            self.stop_all_moves()
             self.log_info('战斗任务结束', notify=True)
 
     def _parse_skill_config(self):
@@ -228,11 +275,14 @@ class CombatTask(BaseGameTask):
                 key=key.strip(),
                 name=f"技能{key}",
                 priority=priority,
-                cooldown=1.0,  # 默认冷却时间
-                last_used=0
+                cooldown=1.0  # 默认冷却时间
             )
             self.skills.append(skill)
 
+        # 技能列表只在这里变化，预先排序/筛选，战斗循环中直接使用
+        self._skills_by_priority = tuple(sorted(self.skills, key=lambda s: s.priority.value, reverse=True))
+        self._burst_skills = tuple(s for s in self._skills_by_priority if s.priority is SkillPriority.HIGH)
+
     def _build_combat_quest(self, combat_mode: CombatMode,
                            target_selection: str, combat_count: int) -> QuestConfig:
         """构建战斗任务链"""
@@ -283,22 +333,16 @@ class CombatTask(BaseGameTask):
 
         return quest
 
-    def _get_enemy_types(self, selection: str) -> List[str]:
+    def _get_enemy_types(self, selection: str) -> Tuple[str, ...]:
         """根据配置获取敌人类型"""
-        if selection == '所有':
-            return ['普通怪', '精英怪']
-        elif selection == '精英怪':
-            return ['精英怪']
-        elif selection == 'Boss':
-            return ['Boss']
-        else:
-            return ['普通怪']
+        return self._ENEMY_TYPE_MAP.get(selection, self._DEFAULT_ENEMY_TYPES)
 
     def _execute_combat(self, combat_mode: CombatMode,
                        hp_threshold: float, mp_threshold: float):
         """执行战斗逻辑"""
         self.in_combat = False
         self.combat_stats['combats'] += 1
+        self.invalidate_frame_cache()
 
         # 根据战斗模式执行不同的逻辑
         if combat_mode == CombatMode.AUTO:
@@ -323,17 +367,22 @@ class CombatTask(BaseGameTask):
         self.in_combat = True
 
         # 3. 战斗循环
-        while self.is_in_combat():
+        next_tick = time.monotonic() + self._combat_tick_period
+        while True:
+            self._tick_movement()
+
+            # 同一帧采样战斗状态和血量蓝量
+            snap = self._sample_status()
+            if not snap.in_combat:
+                break
+
             # 检查血量蓝量
-            if self.check_hp_low(hp_threshold):
-                self._use_hp_potion()
-            if self.check_mp_low(mp_threshold):
-                self._use_mp_potion()
+            self._use_potion_if_needed(snap, hp_threshold, mp_threshold)
 
             # 释放技能
             self._execute_skill_rotation()
 
-            self.sleep(0.5)
+            next_tick = self._wait_next_tick(next_tick)
 
         self.in_combat = False
         self.log_info("战斗结束")
@@ -341,24 +390,29 @@ class CombatTask(BaseGameTask):
     def _defensive_combat(self, hp_threshold: float, mp_threshold: float):
         """防御战斗模式 - 只反击"""
         # 等待进入战斗（被攻击）
-        if not self.wait_until(self.is_in_combat, timeout=30):
+        if not self.wait_with_backoff(self.is_in_combat, timeout=30):
             self.log_info("未遇敌，继续巡逻")
             return
 
         self.in_combat = True
 
         # 战斗循环
-        while self.is_in_combat():
+        next_tick = time.monotonic() + self._combat_tick_period
+        while True:
+            self._tick_movement()
+
+            # 同一帧采样战斗状态和血量蓝量
+            snap = self._sample_status()
+            if not snap.in_combat:
+                break
+
             # 检查血量蓝量
-            if self.check_hp_low(hp_threshold):
-                self._use_hp_potion()
-            if self.check_mp_low(mp_threshold):
-                self._use_mp_potion()
+            self._use_potion_if_needed(snap, hp_threshold, mp_threshold)
 
             # 释放技能
             self._execute_skill_rotation()
 
-            self.sleep(0.5)
+            next_tick = self._wait_next_tick(next_tick)
 
         self.in_combat = False
         self.log_info("防御战斗结束")
@@ -366,7 +420,8 @@ class CombatTask(BaseGameTask):
     def _boss_combat(self, hp_threshold: float, mp_threshold: float):
         """Boss战模式"""
         # Boss战逻辑与自动战斗类似，但更注重爆发技能的使用
-        target = self._find_nearest_enemy()
+        # 只查找Boss模板
+        target = self._find_target(self._boss_ids)
         if not target:
             self.log_warn("未找到Boss")
             return
@@ -374,16 +429,19 @@ class CombatTask(BaseGameTask):
         self._lock_target(target)
         self.in_combat = True
 
-        while self.is_in_combat():
-            if self.check_hp_low(hp_threshold):
-                self._use_hp_potion()
-            if self.check_mp_low(mp_threshold):
-                self._use_mp_potion()
+        next_tick = time.monotonic() + self._combat_tick_period
+        while True:
+            self._tick_movement()
+            snap = self._sample_status()
+            if not snap.in_combat:
+                break
+
+            self._use_potion_if_needed(snap, hp_threshold, mp_threshold)
 
             # Boss战优先使用高优先级技能
             self._execute_burst_skill_rotation()
 
-            self.sleep(0.5)
+            next_tick = self._wait_next_tick(next_tick)
 
         self.in_combat = False
         self.log_info("Boss战结束")
@@ -394,33 +452,143 @@ class CombatTask(BaseGameTask):
         while True:
             self._auto_combat(hp_threshold, mp_threshold)
 
-            # 移动到下一个位置
+            # 移动到下一个位置（移动期间继续检测状态）
             self._move_to_next_farm_spot()
+            self._wait_movement(hp_threshold, mp_threshold)
 
             # 检查是否完成循环次数
             if not self.is_in_combat():
                 break
 
+    def _wait_next_tick(self, next_tick: float) -> float:
+        """
+        等待到本次节拍的截止时间
+        :param next_tick: 本次截止时间（monotonic）
+        :return: 下一次截止时间；本次已超时则从当前时间重新对齐
+        """
+        now = time.monotonic()
+        if now > next_tick:
+            self.log_debug(f"战斗循环超时 {now - next_tick:.2f} 秒，重新对齐节拍")
+            # 超时也要让出一次，保证框架的暂停/停止检查和检测tick推进不被跳过
+            self.sleep(0)
+            return time.monotonic() + self._combat_tick_period
+        self.sleep(next_tick - now)
+        return next_tick + self._combat_tick_period
+
+    def _refresh_enemy_order(self):
+        """按优先级从高到低重建敌人扫描顺序（enemy_configs变化后调用）"""
+        self._sorted_enemy_configs = sorted(
+            self.enemy_configs.items(), key=lambda item: item[1].priority, reverse=True
+        )
+        self._boss_ids = tuple(c.enemy_id for _, c in self._sorted_enemy_configs if c.is_boss)
+
+    def _enemy_scan_order(self):
+        """敌人扫描顺序：上次找到的敌人类型优先，其余按优先级"""
+        last = self._last_enemy_type
+        if last is not None and last in self.enemy_configs:
+            yield last, self.enemy_configs[last]
+        for enemy_type, config in self._sorted_enemy_configs:
+            if enemy_type != last:
+                yield enemy_type, config
+
     def _find_nearest_enemy(self) -> Optional[tuple]:
         """查找最近的敌人"""
-        # 遍历所有敌人类型，找到最近的
+        return self._find_target(None)
+
+    def _find_target(self, enemy_ids: Optional[Tuple[str, ...]]) -> Optional[tuple]:
+        """
+        查找最近的目标敌人
+        :param enemy_ids: 只匹配这些敌人ID的模板，None表示所有敌人
+        :return: 目标坐标，未找到返回None
+        """
+        # 遍历敌人类型，找到最近的
         nearest_enemy = None
         min_distance = float('inf')
 
-        for enemy_type, config in self.enemy_configs.items():
-            pos = self.find_one(config.enemy_id)
+        for enemy_type, config in self._enemy_scan_order():
+            if enemy_ids is not None and config.enemy_id not in enemy_ids:
+                continue
+            pos = self._match_in_viewport(config.enemy_id)
             if pos:
-                # 计算到屏幕中心的距离
-                distance = ((pos[0] - 0.5) ** 2 + (pos[1] - 0.5) ** 2) ** 0.5
+                # 计算到屏幕中心的距离（只用于比较，平方距离即可）
+                dx = pos[0] - 0.5
+                dy = pos[1] - 0.5
+                distance = dx * dx + dy * dy
                 if distance < min_distance:
                     min_distance = distance
-                    nearest_enemy = (pos, config)
+                    nearest_enemy = (enemy_type, pos, config)
+                # Boss已经足够近，不再扫描其他敌人
+                if config.is_boss and distance < self.boss_lock_radius_sq:
+                    nearest_enemy = (enemy_type, pos, config)
+                    break
 
         if nearest_enemy:
-            self.current_target = nearest_enemy[1]
-            return nearest_enemy[0]
+            self._last_enemy_type = nearest_enemy[0]
+            self.current_target = nearest_enemy[2]
+            return nearest_enemy[1]
         return None
 
+    def _match_in_viewport(self, enemy_id: str) -> Optional[Tuple[float, float]]:
+        """
+        在搜索区域内匹配敌人模板，所有敌人模板共用同一帧裁剪出的灰度区域
+        :param enemy_id: 敌人模板ID
+        :return: 敌人中心的全屏相对坐标，未找到返回None
+        """
+        matches = self._frame_cache['matches']
+        key = ('viewport', enemy_id)
+        if key in matches:
+            return matches[key]
+
+        template = self._enemy_template(enemy_id)
+        if template is None:
+            # 取不到模板时退回框架的区域查找，结果同样换算为全屏相对坐标
+            return self._box_center(self._cached_find_one(enemy_id, box=self.combat_viewport))
+
+        roi = self._viewport_gray()
+        pos = None
+        if roi is not None:
+            gray, x0, y0, width, height = roi
+            template_h, template_w = template.shape[:2]
+            if gray.shape[0] >= template_h and gray.shape[1] >= template_w:
+                result = cv2.matchTemplate(gray, template, cv2.TM_CCOEFF_NORMED)
+                _, max_val, _, max_loc = cv2.minMaxLoc(result)
+                if max_val >= self.enemy_match_threshold:
+                    pos = ((x0 + max_loc[0] + template_w / 2) / width,
+                           (y0 + max_loc[1] + template_h / 2) / height)
+        matches[key] = pos
+        return pos
+
+    def _viewport_gray(self):
+        """获取当前帧搜索区域的灰度图 (灰度图, x0, y0, 帧宽, 帧高)，同一帧只裁剪一次"""
+        frame = self._cached_frame()
+        if frame is None:
+            return None
+        cache = self._viewport_cache
+        if cache['frame'] is not frame:
+            y0, y1, x0, x1 = self._area_roi(self.combat_viewport, frame)
+            height, width = frame.shape[:2]
+            gray = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+            cache['gray'] = (gray, x0, y0, width, height)
+            cache['frame'] = frame
+        return cache['gray']
+
+    def _enemy_template(self, enemy_id: str):
+        """获取敌人灰度模板（按分辨率缓存）"""
+        frame = self._cached_frame()
+        if frame is None:
+            return None
+        key = (enemy_id, frame.shape[1])
+        template = self._enemy_templates.get(key)
+        if template is None:
+            feature = self.get_feature_by_name(enemy_id)
+            if feature is None:
+                return None
+            template = feature.mat
+            if template.ndim == 3:
+                template = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
+            self._enemy_templates[key] = template
+        return template
+
     def _lock_target(self, target_pos: tuple):
         """锁定目标"""
         # 点击目标
@@ -431,12 +599,9 @@ class CombatTask(BaseGameTask):
 
     def _execute_skill_rotation(self):
         """执行技能循环"""
-        # 按优先级排序技能
-        sorted_skills = sorted(self.skills, key=lambda s: s.priority.value, reverse=True)
-
-        current_time = time.time()
+        current_time = time.monotonic()
 
-        for skill in sorted_skills:
+        for skill in self._skills_by_priority:
             # 检查冷却
             if current_time - skill.last_used < skill.cooldown:
                 continue
@@ -445,8 +610,9 @@ class CombatTask(BaseGameTask):
             if skill.condition and not skill.condition():
                 continue
 
-            # 释放技能
-            self.cast_skill(skill.key)
+            # 释放技能，后摇未结束则等待下一次循环
+            if not self.cast_skill(skill.key):
+                break
             skill.last_used = current_time
             self.combat_stats['skills_used'] += 1
 
@@ -456,32 +622,46 @@ class CombatTask(BaseGameTask):
     def _execute_burst_skill_rotation(self):
         """爆发技能循环（Boss战用）"""
         # 只使用高优先级技能
-        burst_skills = [s for s in self.skills if s.priority == SkillPriority.HIGH]
+        current_time = time.monotonic()
 
-        current_time = time.time()
-
-        for skill in burst_skills:
+        for skill in self._burst_skills:
             if current_time - skill.last_used < skill.cooldown:
                 continue
 
-            self.cast_skill(skill.key)
+            if not self.cast_skill(skill.key):
+                break
             skill.last_used = current_time
             self.combat_stats['skills_used'] += 1
             break
 
+    def _use_potion_if_needed(self, snap: StatusSnapshot, hp_threshold: float, mp_threshold: float):
+        """
+        根据状态采样决定是否吃药，每次最多使用一种药
+        血量蓝量都低时优先补百分比更低的一项
+        """
+        need_hp = snap.hp_pct < hp_threshold
+        need_mp = snap.mp_pct < mp_threshold
+        if need_hp and need_mp:
+            if snap.hp_pct <= snap.mp_pct:
+                self._use_hp_potion()
+            else:
+                self._use_mp_potion()
+        elif need_hp:
+            self._use_hp_potion()
+        elif need_mp:
+            self._use_mp_potion()
+
     def _use_hp_potion(self):
         """使用血药"""
-        key = self.config.get('血药快捷键', '0')
-        self.cast_skill(key)
-        self.combat_stats['potions_used'] += 1
-        self.log_info("使用血药")
+        if self.cast_skill(self._hp_potion_key):
+            self.combat_stats['potions_used'] += 1
+            self.log_info("使用血药")
 
     def _use_mp_potion(self):
         """使用蓝药"""
-        key = self.config.get('蓝药快捷键', '9')
-        self.cast_skill(key)
-        self.combat_stats['potions_used'] += 1
-        self.log_info("使用蓝药")
+        if self.cast_skill(self._mp_potion_key):
+            self.combat_stats['potions_used'] += 1
+            self.log_info("使用蓝药")
 
     def _loot_items(self):
         """拾取物品"""
@@ -493,16 +673,23 @@ class CombatTask(BaseGameTask):
     def _move_to_next_farm_spot(self):
         """移动到下一个刷怪点"""
         # 简单实现：随机移动
-        import random
-        direction = random.choice(['left', 'right', 'forward'])
-        duration = random.uniform(2.0, 5.0)
-
-        if direction == 'left':
-            self.move_left(duration)
-        elif direction == 'right':
-            self.move_right(duration)
-        else:
-            self.move_forward(duration)
+        direction = self._farm_directions[self._rng.randrange(len(self._farm_directions))]
+        duration = self._rng.uniform(2.0, 5.0)
+
+        self.start_move(direction, duration)
+
+    def _wait_movement(self, hp_threshold: float, mp_threshold: float):
+        """等待移动结束，期间持续检测血量蓝量，遇敌立即停止移动"""
+        while self.is_moving:
+            snap = self._sample_status()
+            if snap.in_combat:
+                self.stop_all_moves()
+                break
+
+            self._use_potion_if_needed(snap, hp_threshold, mp_threshold)
+
+            self.sleep(0.1)
+            self._tick_movement()
 
     def _handle_death(self):
         """处理死亡"""
@@ -2,8 +2,11 @@
 游戏任务系统 - 整合采集和战斗的主任务
 支持UI配置和可扩展的任务系统
 """
-from typing import Dict, List, Optional
-from dataclasses import dataclass
+import heapq
+import itertools
+import time
+from typing import Dict, List, Optional, Iterable, Mapping, Tuple, Union
+from dataclasses import dataclass, field
 
 from qfluentwidgets import FluentIcon, ComboBox, PushButton, CheckBox, SpinBox, DoubleSpinBox
 
@@ -13,7 +16,7 @@ from src.tasks.CombatTask import CombatTask
 from src.tasks.QuestManager import QuestManager, QuestConfig, QuestTask, TaskType
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class GameTaskConfig:
     """游戏任务配置"""
     task_id: str                      # 任务ID
@@ -22,7 +25,15 @@ class GameTaskConfig:
     enabled: bool = False             # 是否启用
     priority: int = 0                 # 执行优先级
     loop: bool = False                # 是否循环
-    config: Dict = None               # 任务配置参数
+    config: Mapping = field(default_factory=dict)  # 任务配置参数
+
+
+@dataclass(slots=True, frozen=True)
+class _RunCtx:
+    """各执行模式共用的状态检查阈值，run 开始时读取一次后传入"""
+    hp_threshold: float               # 血量低于该百分比使用血药
+    mp_threshold: float               # 蓝量低于该百分比使用蓝药
+    stop_on_death: bool               # 死亡后是否停止任务
 
 
 class GameQuestTask(BaseGameTask):
@@ -52,6 +63,12 @@ class GameQuestTask(BaseGameTask):
         self.gathering_task = GatheringTask(*args, **kwargs)
         self.combat_task = CombatTask(*args, **kwargs)
 
+        # 任务类型 -> 执行该类型任务的子任务
+        self._handlers: Dict[str, BaseGameTask] = {
+            'gathering': self.gathering_task,
+            'combat': self.combat_task,
+        }
+
         # 默认配置
         self.default_config.update({
             '任务执行模式': '顺序执行',  # 顺序执行、优先级执行、循环执行
@@ -90,27 +107,36 @@ class GameQuestTask(BaseGameTask):
             'options': ['auto', 'defensive', 'boss', 'farm']
         }
 
+        # 自定义任务注册表：task_id -> 任务配置
+        self._custom_tasks: Dict[str, GameTaskConfig] = {}
+
+        # 优先级队列的入队序号，同优先级按入队顺序执行
+        self._queue_seq = itertools.count()
+
         # 任务统计
         self.task_stats = {
             'total_completed': 0,
             'gathering_completed': 0,
             'combat_completed': 0,
+            'custom_completed': 0,
             'total_time': 0
         }
 
     def run(self):
         """任务执行入口"""
         self.log_info('游戏任务系统启动', notify=True)
+        self._stop_event.clear()
 
-        import time
-        start_time = time.time()
+        start_time = time.monotonic()
 
         try:
             # 获取配置
             exec_mode = self.config.get('任务执行模式', '顺序执行')
-            hp_threshold = self.config.get('血量低于%逃离', 30)
-            mp_threshold = self.config.get('蓝量低于%补蓝', 20)
-            stop_on_death = self.config.get('死亡后停止任务', True)
+            ctx = _RunCtx(
+                hp_threshold=self.config.get('血量低于%逃离'),
+                mp_threshold=self.config.get('蓝量低于%补蓝'),
+                stop_on_death=self.config.get('死亡后停止任务'),
+            )
 
             # 构建任务队列
             task_queue = self._build_task_queue()
@@ -121,14 +147,14 @@ class GameQuestTask(BaseGameTask):
 
             # 根据执行模式执行任务
             if exec_mode == '顺序执行':
-                self._execute_sequential(task_queue, hp_threshold, mp_threshold, stop_on_death)
+                self._execute_sequential(task_queue, ctx)
             elif exec_mode == '优先级执行':
-                self._execute_by_priority(task_queue, hp_threshold, mp_threshold, stop_on_death)
+                self._execute_by_priority(task_queue, ctx)
             elif exec_mode == '循环执行':
-                self._execute_loop(task_queue, hp_threshold, mp_threshold, stop_on_death)
+                self._execute_loop(task_queue, ctx)
 
             # 显示统计
-            self.task_stats['total_time'] = time.time() - start_time
+            self.task_stats['total_time'] = time.monotonic() - start_time
             self._show_statistics()
 
         except Exception as e:
@@ -138,25 +164,9 @@ class GameQuestTask(BaseGameTask):
             self.log_info('游戏任务系统结束', notify=True)
 
     def _build_task_queue(self) -> List[GameTaskConfig]:
-        """构建任务队列"""
+        """构建任务队列（按优先级从高到低依次加入，无需再排序）"""
         queue = []
 
-        # 添加采集任务
-        if self.config.get('采集任务_启用', False):
-            gathering_config = GameTaskConfig(
-                task_id='gathering_main',
-                task_name='日常采集',
-                task_type='gathering',
-                enabled=True,
-                priority=1,
-                loop=self.config.get('采集循环', False),
-                config={
-                    'target_selection': self.config.get('采集目标', '所有'),
-                    'loop_delay': self.config.get('采集循环间隔', 10)
-                }
-            )
-            queue.append(gathering_config)
-
         # 添加战斗任务
         if self.config.get('战斗任务_启用', False):
             combat_config = GameTaskConfig(
@@ -173,36 +183,52 @@ class GameQuestTask(BaseGameTask):
             )
             queue.append(combat_config)
 
-        # 按优先级排序
-        queue.sort(key=lambda x: x.priority, reverse=True)
+        # 添加采集任务
+        if self.config.get('采集任务_启用', False):
+            gathering_config = GameTaskConfig(
+                task_id='gathering_main',
+                task_name='日常采集',
+                task_type='gathering',
+                enabled=True,
+                priority=1,
+                loop=self.config.get('采集循环', False),
+                config={
+                    'target_selection': self.config.get('采集目标', '所有'),
+                    'loop_delay': self.config.get('采集循环间隔', 10)
+                }
+            )
+            queue.append(gathering_config)
+
+        # 添加自定义任务，与内置任务一起按优先级排列（稳定排序，同优先级保持注册顺序）
+        custom = [tc for tc in self._custom_tasks.values() if tc.enabled]
+        if custom:
+            queue = sorted(queue + custom, key=lambda x: x.priority, reverse=True)
 
         return queue
 
-    def _execute_sequential(self, task_queue: List[GameTaskConfig],
-                           hp_threshold: float, mp_threshold: float,
-                           stop_on_death: bool):
+    def _execute_sequential(self, task_queue: List[GameTaskConfig], ctx: _RunCtx):
         """顺序执行任务"""
         for task_config in task_queue:
             self.log_info(f"执行任务: {task_config.task_name}")
 
-            # 检查角色状态
-            state = self.check_game_state()
-            if state == GameState.DEAD:
+            # 一次采样角色状态、血量和蓝量
+            status = self.sample_player_status()
+            if status.state == GameState.DEAD:
                 self.log_error("角色已死亡")
-                if stop_on_death:
+                if ctx.stop_on_death:
                     break
                 else:
                     self._handle_death()
                     continue
 
             # 检查血量
-            if self.check_hp_low(hp_threshold):
-                self.log_warn(f"血量低于{hp_threshold}%，使用血药")
+            if status.hp_pct < ctx.hp_threshold:
+                self.log_warn(f"血量低于{ctx.hp_threshold}%，使用血药")
                 self._use_potion('hp')
 
             # 检查蓝量
-            if self.check_mp_low(mp_threshold):
-                self.log_warn(f"蓝量低于{mp_threshold}%，使用蓝药")
+            if status.mp_pct < ctx.mp_threshold:
+                self.log_warn(f"蓝量低于{ctx.mp_threshold}%，使用蓝药")
                 self._use_potion('mp')
 
             # 执行任务
@@ -211,24 +237,27 @@ class GameQuestTask(BaseGameTask):
                 self.task_stats['total_completed'] += 1
                 if task_config.task_type == 'gathering':
                     self.task_stats['gathering_completed'] += 1
-                else:
+                elif task_config.task_type == 'combat':
                     self.task_stats['combat_completed'] += 1
+                elif task_config.task_type == 'custom':
+                    self.task_stats['custom_completed'] += 1
+
+    def _execute_by_priority(self, task_queue: List[GameTaskConfig], ctx: _RunCtx):
+        """
+        按优先级执行任务（动态选择），每个任务执行一次
+        """
+        heap = self._make_priority_queue(task_queue)
 
-    def _execute_by_priority(self, task_queue: List[GameTaskConfig],
-                            hp_threshold: float, mp_threshold: float,
-                            stop_on_death: bool):
-        """按优先级执行任务（动态选择）"""
-        while task_queue:
-            # 找到优先级最高的任务
-            task_config = max(task_queue, key=lambda x: x.priority)
-            task_queue.remove(task_config)
+        while heap and not self._stop_event.is_set():
+            # 取出优先级最高的任务
+            _, _, task_config = heapq.heappop(heap)
 
             self.log_info(f"执行任务: {task_config.task_name}")
 
             # 状态检查
             state = self.check_game_state()
             if state == GameState.DEAD:
-                if stop_on_death:
+                if ctx.stop_on_death:
                     break
                 else:
                     self._handle_death()
@@ -239,11 +268,21 @@ class GameQuestTask(BaseGameTask):
             if success:
                 self.task_stats['total_completed'] += 1
 
-    def _execute_loop(self, task_queue: List[GameTaskConfig],
-                     hp_threshold: float, mp_threshold: float,
-                     stop_on_death: bool):
+    def _make_priority_queue(self, task_configs: Iterable[GameTaskConfig]) -> List[Tuple[int, int, GameTaskConfig]]:
+        """
+        构建优先级队列（最小堆），元素为 (-优先级, 入队序号, 任务配置)
+        之后可直接用 heapq.heappush 追加任务，无需重建
+        """
+        heap = [(-tc.priority, next(self._queue_seq), tc) for tc in task_configs]
+        heapq.heapify(heap)
+        return heap
+
+    def _execute_loop(self, task_queue: List[GameTaskConfig], ctx: _RunCtx):
         """循环执行任务"""
-        import time
+        # 没有循环任务时只需执行一轮，与顺序执行相同
+        if not any(t.loop for t in task_queue):
+            self._execute_sequential(task_queue, ctx)
+            return
 
         loop_count = 0
         max_loops = 100  # 最大循环次数
@@ -254,12 +293,12 @@ class GameQuestTask(BaseGameTask):
 
             # 执行所有任务
             for task_config in task_queue:
-                self.log_info(f"执行任务: {task_config.task_name}")
+                self.log_debug(f"执行任务: {task_config.task_name}")
 
                 # 状态检查
                 state = self.check_game_state()
                 if state == GameState.DEAD:
-                    if stop_on_death:
+                    if ctx.stop_on_death:
                         return
                     else:
                         self._handle_death()
@@ -268,43 +307,49 @@ class GameQuestTask(BaseGameTask):
                 # 执行任务
                 self._execute_single_task(task_config)
 
-            # 如果任务不循环，执行一轮后退出
-            if not any(t.loop for t in task_queue):
-                break
-
-            # 等待下一轮
+            # 等待下一轮，等待期间继续监控血量蓝量
             self.log_info("等待 10 秒后开始下一轮")
-            time.sleep(10)
+            stopped = self._wait_with_status_monitor(
+                10, ctx.hp_threshold, lambda: self._use_potion('hp'),
+                ctx.mp_threshold, lambda: self._use_potion('mp')
+            )
+            if stopped:
+                self.log_info("收到停止请求，结束循环")
+                return
 
     def _execute_single_task(self, task_config: GameTaskConfig) -> bool:
         """执行单个任务"""
         try:
-            if task_config.task_type == 'gathering':
-                # 将配置传递给采集任务
-                for key, value in task_config.config.items():
-                    self.gathering_task.config[key] = value
-
-                # 执行采集任务
-                self.gathering_task.run()
+            if task_config.task_type == 'custom':
+                # 执行自定义任务
+                task_config.config['executor']()
                 return True
 
-            elif task_config.task_type == 'combat':
-                # 将配置传递给战斗任务
-                for key, value in task_config.config.items():
-                    self.combat_task.config[key] = value
-
-                # 执行战斗任务
-                self.combat_task.run()
-                return True
-
-            else:
+            subtask = self._handlers.get(task_config.task_type)
+            if subtask is None:
                 self.log_warn(f"未知任务类型: {task_config.task_type}")
                 return False
 
+            # 将配置传递给子任务，沿用刚检测过的状态执行
+            subtask.config.update(task_config.config)
+            subtask.prime_from(self)
+            subtask.run()
+            return True
+
         except Exception as e:
             self.log_error(f"任务执行失败: {task_config.task_name}, 错误: {e}")
             return False
 
+        finally:
+            # 子任务运行期间画面和角色状态都已变化，之前采样的结果不能再用
+            self.invalidate_frame_cache()
+
+    def request_stop(self):
+        """请求停止任务，同时通知正在执行的子任务"""
+        super().request_stop()
+        for subtask in self._handlers.values():
+            subtask.request_stop()
+
     def _use_potion(self, potion_type: str):
         """使用药水"""
         if potion_type == 'hp':
@@ -312,6 +357,7 @@ class GameQuestTask(BaseGameTask):
         else:
             key = self.config.get('蓝药快捷键', '9')
 
+        self.wait_skill_ready()
         self.cast_skill(key)
         self.sleep(1)
 
@@ -324,20 +370,24 @@ class GameQuestTask(BaseGameTask):
     def _show_statistics(self):
         """显示任务统计"""
         stats = self.task_stats
-        self.log_info("=" * 40)
-        self.log_info("任务执行统计")
-        self.log_info("=" * 40)
-        self.log_info(f"总完成数: {stats['total_completed']}")
-        self.log_info(f"采集任务: {stats['gathering_completed']}")
-        self.log_info(f"战斗任务: {stats['combat_completed']}")
-        self.log_info(f"总耗时: {stats['total_time']:.1f}秒")
-        self.log_info("=" * 40)
+        self.log_info("\n".join([
+            "=" * 40,
+            "任务执行统计",
+            "=" * 40,
+            f"总完成数: {stats['total_completed']}",
+            f"采集任务: {stats['gathering_completed']}",
+            f"战斗任务: {stats['combat_completed']}",
+            f"自定义任务: {stats['custom_completed']}",
+            f"总耗时: {stats['total_time']:.1f}秒",
+            "=" * 40,
+        ]))
 
     # ==================== 扩展接口 ====================
 
-    def register_custom_task(self, task_config: GameTaskConfig):
+    def register_custom_task(self, task_configs: Union[GameTaskConfig, Iterable[GameTaskConfig]]):
         """
-        注册自定义任务
+        注册自定义任务，可传入单个任务配置或任务配置列表
+        相同 task_id 的任务会被覆盖
 
         使用示例：
         ```python
@@ -354,8 +404,11 @@ class GameQuestTask(BaseGameTask):
         task.register_custom_task(config)
         ```
         """
-        # 可以通过修改任务列表来添加自定义任务
-        self.log_info(f"注册自定义任务: {task_config.task_name}")
+        if isinstance(task_configs, GameTaskConfig):
+            task_configs = (task_configs,)
+        for task_config in task_configs:
+            self._custom_tasks[task_config.task_id] = task_config
+            self.log_info(f"注册自定义任务: {task_config.task_name}")
 
     def add_gathering_resource(self, resource_id: str, resource_name: str,
                               minimap_marker: str):
@@ -379,7 +432,7 @@ class GameQuestTask(BaseGameTask):
             minimap_marker=minimap_marker
         )
 
-        self.gathering_task.resource_configs[resource_name] = resource
+        self.gathering_task.add_resource(resource_name, resource)
         self.log_info(f"添加采集资源: {resource_name}")
 
     def add_enemy_target(self, enemy_id: str, enemy_name: str,
@@ -2,7 +2,9 @@
 采集任务模块 - 自动采集资源
 """
 import re
-from typing import List, Dict, Optional
+from collections import Counter
+from functools import partial
+from typing import List, Dict, Optional, Tuple
 from dataclasses import dataclass
 
 from qfluentwidgets import FluentIcon
@@ -11,7 +13,7 @@ from src.tasks.BaseGameTask import BaseGameTask, GameState
 from src.tasks.QuestManager import QuestManager, QuestConfig, QuestTask, TaskType, QuestStatus
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class GatheringResource:
     """采集资源配置"""
     resource_id: str              # 资源ID（对应图片模板名称）
@@ -62,10 +64,13 @@ class GatheringTask(BaseGameTask):
             'options': ['所有', '仅矿点', '仅草药', '仅树木', '自定义']
         }
 
+        # 反击时的技能顺序，每次运行开始时从配置解析
+        self._skill_sequence: Tuple[str, ...] = ('1', '2', '3')
+
         # 统计信息
         self.gathering_stats = {
             'total_gathered': 0,
-            'by_type': {}
+            'by_type': Counter()
         }
 
         # 资源配置（可以根据游戏实际情况修改）
@@ -93,12 +98,17 @@ class GatheringTask(BaseGameTask):
             ),
         }
 
+        # 已构建的采集任务链缓存，资源配置变化时版本号递增
+        self._resource_version = 0
+        self._quest_cache: Dict[tuple, QuestConfig] = {}
+
     def run(self):
         """任务执行入口"""
         self.log_info('采集任务开始', notify=True)
+        self._stop_event.clear()
 
         # 重置统计
-        self.gathering_stats = {'total_gathered': 0, 'by_type': {}}
+        self.gathering_stats = {'total_gathered': 0, 'by_type': Counter()}
 
         try:
             # 获取配置
@@ -107,6 +117,7 @@ class GatheringTask(BaseGameTask):
             loop_delay = self.config.get('采集循环间隔(秒)', 10)
             fight_back = self.config.get('战斗时是否反击', True)
             hp_threshold = self.config.get('血量低于%自动逃离', 30)
+            self._skill_sequence = tuple(self.config.get('战斗技能顺序', '1-2-3').split('-'))
 
             # 确定要采集的资源类型
             resource_types = self._get_resource_types(target_selection)
@@ -122,22 +133,24 @@ class GatheringTask(BaseGameTask):
 
             # 执行任务
             while True:
-                # 检查状态
-                state = self.check_game_state()
-                if state == GameState.DEAD:
+                # 检查状态，状态和血量在同一帧上一次采样
+                status = self.sample_player_status()
+                if status.state == GameState.DEAD:
                     self.log_error("角色已死亡，停止采集")
                     break
 
-                if state == GameState.IN_COMBAT:
+                if status.state == GameState.IN_COMBAT:
                     if fight_back:
                         self.log_info("进入战斗，反击中...")
                         self._handle_combat(hp_threshold)
                     else:
                         self.log_warn("进入战斗，等待脱战...")
                         self.wait_until_out_of_combat()
+                    # 战斗后血量已变化，重新采样
+                    status = self.sample_player_status()
 
                 # 检查血量
-                if self.check_hp_low(hp_threshold):
+                if status.hp_pct < hp_threshold:
                     self.log_warn(f"血量低于{hp_threshold}%，使用血药")
                     self._use_hp_potion()
 
@@ -151,9 +164,11 @@ class GatheringTask(BaseGameTask):
                 if not loop_enabled:
                     break
 
-                # 循环延迟
+                # 循环延迟，等待期间继续监控血量
                 self.log_info(f"等待 {loop_delay} 秒后继续采集")
-                self.sleep(loop_delay)
+                if self._wait_with_status_monitor(loop_delay, hp_threshold, self._use_hp_potion):
+                    self.log_info("收到停止请求，结束采集")
+                    break
 
             # 显示统计
             self._show_statistics()
@@ -164,6 +179,11 @@ class GatheringTask(BaseGameTask):
         finally:
             self.log_info('采集任务结束', notify=True)
 
+    def request_stop(self):
+        """请求停止任务，同时取消正在执行的任务链（循环模式下任务链不会自行返回）"""
+        super().request_stop()
+        self.quest_manager.stop_current_execution()
+
     def _get_resource_types(self, selection: str) -> List[str]:
         """根据配置获取要采集的资源类型"""
         if selection == '所有':
@@ -180,15 +200,19 @@ class GatheringTask(BaseGameTask):
 
     def _build_gathering_quest(self, resource_types: List[str],
                                loop_enabled: bool, loop_delay: float) -> QuestConfig:
-        """构建采集任务链"""
+        """构建采集任务链（相同参数直接复用，执行前任务状态会被重置）"""
+        key = (tuple(resource_types), loop_enabled, loop_delay, self._resource_version)
+        quest = self._quest_cache.get(key)
+        if quest is not None:
+            return quest
+
         tasks = []
 
         for resource_type in resource_types:
-            if resource_type not in self.resource_configs:
+            config = self.resource_configs.get(resource_type)
+            if config is None:
                 continue
 
-            config = self.resource_configs[resource_type]
-
             # 创建采集任务
             task = QuestTask(
                 task_id=f"gather_{resource_type}",
@@ -203,7 +227,7 @@ class GatheringTask(BaseGameTask):
                     'gather_key': config.gather_key,
                     'timeout': 60.0
                 },
-                on_complete=lambda r=resource_type: self._on_gather_complete(r)
+                on_complete=partial(self._on_gather_complete, resource_type)
             )
 
             tasks.append(task)
@@ -219,40 +243,50 @@ class GatheringTask(BaseGameTask):
             tasks=tasks
         )
 
+        self._quest_cache[key] = quest
         return quest
 
+    def add_resource(self, resource_type: str, resource: GatheringResource):
+        """
+        添加或替换采集资源配置
+        :param resource_type: 资源类型
+        :param resource: 资源配置
+        """
+        self.resource_configs[resource_type] = resource
+        self._resource_version += 1
+        self._quest_cache.clear()
+
     def _on_gather_complete(self, resource_type: str):
         """采集完成回调"""
         self.gathering_stats['total_gathered'] += 1
-        if resource_type not in self.gathering_stats['by_type']:
-            self.gathering_stats['by_type'][resource_type] = 0
         self.gathering_stats['by_type'][resource_type] += 1
         self.log_info(f"采集成功: {resource_type}")
 
     def _handle_combat(self, hp_threshold: float):
         """处理战斗"""
         # 简单的战斗逻辑
-        skill_sequence = self.config.get('战斗技能顺序', '1-2-3').split('-')
+        while True:
+            status = self.sample_player_status()
+            if not status.in_combat:
+                break
 
-        while self.is_in_combat():
             # 检查血量
-            if self.check_hp_low(hp_threshold):
+            if status.hp_pct < hp_threshold:
                 self.log_warn("血量过低，逃离战斗")
                 self._flee_combat()
                 break
 
-            # 释放技能
-            for skill in skill_sequence:
-                if self.is_in_combat():
-                    self.cast_skill(skill)
-                else:
-                    break
+            # 释放技能，整轮沿用本轮采样的战斗状态，下一轮再重新采样
+            for skill in self._skill_sequence:
+                self.wait_skill_ready()
+                self.cast_skill(skill)
 
             self.sleep(0.5)
 
     def _use_hp_potion(self):
         """使用血药"""
         # 假设血药快捷键是数字键0
+        self.wait_skill_ready()
         self.cast_skill('0')
         self.sleep(1)
 
@@ -267,13 +301,10 @@ class GatheringTask(BaseGameTask):
     def _show_statistics(self):
         """显示统计信息"""
         stats = self.gathering_stats
-        self.log_info("=" * 40)
-        self.log_info("采集任务统计")
-        self.log_info("=" * 40)
-        self.log_info(f"总采集数: {stats['total_gathered']}")
-        for resource_type, count in stats['by_type'].items():
-            self.log_info(f"  {resource_type}: {count}")
-        self.log_info("=" * 40)
+        lines = ["=" * 40, "采集任务统计", "=" * 40, f"总采集数: {stats['total_gathered']}"]
+        lines.extend(f"  {resource_type}: {count}" for resource_type, count in stats['by_type'].most_common())
+        lines.append("=" * 40)
+        self.log_info("\n".join(lines))
 
     # ==================== 辅助方法 ====================
 
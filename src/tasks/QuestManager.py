@@ -1,10 +1,14 @@
 """
 任务管理器 - 管理任务状态、导航和执行流程
 """
-import re
+import heapq
+import threading
 import time
+from collections import Counter, deque
 from enum import Enum
-from typing import Dict, List, Optional, Callable, Any
+from functools import partial
+from types import MappingProxyType
+from typing import Deque, Dict, List, Optional, Callable, Any, Tuple
 from dataclasses import dataclass, field
 
 from ok import Logger
@@ -31,7 +35,7 @@ class TaskType(Enum):
     CUSTOM = "custom"         # 自定义
 
 
-@dataclass
+@dataclass(slots=True)
 class QuestTask:
     """单个任务数据结构"""
     task_id: str                      # 任务唯一ID
@@ -49,9 +53,27 @@ class QuestTask:
     on_start: Optional[Callable[[], None]] = None         # 任务开始回调
     on_complete: Optional[Callable[[], None]] = None      # 任务完成回调
     on_fail: Optional[Callable[[], None]] = None          # 任务失败回调
+    _type_str: str = field(init=False, repr=False, compare=False)  # 任务类型字符串（用于日志）
+    _fast_exec: Optional[Callable[[], bool]] = field(default=None, init=False, repr=False, compare=False)  # 自定义任务的执行函数（注册时解析）
+    _params: Optional[Dict[str, Any]] = field(default=None, init=False, repr=False, compare=False)  # 补全默认值后的任务参数（注册时解析）
+    _timeout: float = field(default=0.0, init=False, repr=False, compare=False)  # 实际超时时间（注册时解析）
 
+    def __post_init__(self):
+        self._type_str = self.task_type.value
 
-@dataclass
+
+# 各任务类型的参数默认值
+_TASK_DEFAULTS: Dict[TaskType, Dict[str, Any]] = {
+    TaskType.GATHERING: {'resource_name': None, 'minimap_marker': None, 'gather_count': 1, 'gather_key': 'f'},
+    TaskType.COMBAT: {'target_name': None, 'skill_sequence': ['1', '2', '3'], 'kill_count': 1},
+    TaskType.INTERACT: {'target_name': None, 'interact_key': 'f'},
+    TaskType.MOVE_TO: {'quest_index': 0},
+    TaskType.WAIT: {'wait_time': 1.0},
+    TaskType.CUSTOM: {'executor': None},
+}
+
+
+@dataclass(slots=True)
 class QuestConfig:
     """任务链配置"""
     quest_id: str                      # 任务链ID
@@ -61,6 +83,8 @@ class QuestConfig:
     loop: bool = False                 # 是否循环执行
     loop_delay: float = 5.0            # 循环间隔（秒）
     tasks: List[QuestTask] = field(default_factory=list)  # 任务列表
+    priority: int = 0                  # 任务链优先级（批量执行时使用）
+    _dirty: set = field(default_factory=set, init=False, repr=False, compare=False)  # 上次执行后状态有变化的任务下标
 
 
 class QuestManager:
@@ -75,6 +99,9 @@ class QuestManager:
     5. 循环执行任务链
     """
 
+    # 每次重试后任务在队列中降低的优先级
+    RETRY_PRIORITY_PENALTY = 10
+
     def __init__(self, game_task):
         """
         初始化任务管理器
@@ -84,19 +111,31 @@ class QuestManager:
         self.quests: Dict[str, QuestConfig] = {}  # 所有任务链
         self.current_quest: Optional[QuestConfig] = None
         self.current_task: Optional[QuestTask] = None
-        self.quest_history: List[Dict] = []       # 任务执行历史
+        self.quest_history: Deque[Dict] = deque(maxlen=100)  # 任务执行历史（最多保留100条）
         self.statistics = {
             'total_tasks': 0,
             'completed_tasks': 0,
             'failed_tasks': 0,
             'skipped_tasks': 0
         }
+        # 统计信息的只读实时视图，供界面轮询读取，无需复制
+        self.statistics_view = MappingProxyType(self.statistics)
+
+        # 取消标志：stop_current_execution 后置位，执行循环在下一个检测点退出
+        self._cancel = threading.Event()
+
+        # 查找结果短时缓存：(模板名称, 时间桶) -> 查找结果
+        self._find_cache: Dict[Tuple[str, int], Any] = {}
 
     def register_quest(self, quest: QuestConfig):
         """
         注册任务链
         :param quest: 任务链配置
         """
+        # 注册时解析任务参数，配置错误尽早暴露
+        for task in quest.tasks:
+            self._prepare_task(task)
+
         self.quests[quest.quest_id] = quest
         logger.info(f"注册任务链: {quest.quest_name} ({quest.quest_id})")
 
@@ -117,6 +156,21 @@ class QuestManager:
         """获取所有启用的任务链"""
         return [q for q in self.quests.values() if q.enabled]
 
+    @staticmethod
+    def _prepare_task(task: QuestTask):
+        """
+        解析任务参数：补全默认值、确定超时时间、解析自定义任务的执行函数
+        :param task: 任务对象
+        """
+        params = dict(_TASK_DEFAULTS.get(task.task_type, {}))
+        params.update(task.config)
+        if task.task_type is TaskType.CUSTOM:
+            if params['executor'] is None:
+                raise ValueError(f"自定义任务缺少executor配置: {task.name}")
+            task._fast_exec = params['executor']
+        task._timeout = params.get('timeout', task.timeout)
+        task._params = params
+
     # ==================== 任务执行 ====================
 
     def execute_quest(self, quest_id: str) -> bool:
@@ -131,42 +185,35 @@ class QuestManager:
             return False
 
         self.current_quest = quest
+        self._cancel.clear()
+        stats_before = dict(self.statistics)
         logger.info(f"开始执行任务链: {quest.quest_name}")
         self.game_task.log_info(f"开始执行任务链: {quest.quest_name}", notify=True)
 
         # 重置所有任务状态
-        for task in quest.tasks:
-            task.status = QuestStatus.PENDING
-            task.retry_count = 0
+        self._reset_tasks(quest)
 
         # 执行任务链
         success = True
         loop_count = 0
 
-        while True:
+        while not self._cancel.is_set():
             loop_count += 1
             if loop_count > 1 and not quest.loop:
                 break
 
-            # 执行所有任务
-            for task in quest.tasks:
-                if not self._execute_single_task(task):
+            # 按优先级执行所有任务
+            ready = self._build_ready_queue(quest.tasks)
+            while ready and not self._cancel.is_set():
+                key, index, task = heapq.heappop(ready)
+                quest._dirty.add(index)
+                if self._execute_single_task(task):
+                    continue
+                if not self._defer_or_fail(task, has_other_tasks=bool(ready)):
                     success = False
-                    if task.retry_count >= task.max_retry:
-                        logger.error(f"任务执行失败，已达最大重试次数: {task.name}")
-                        if task.on_fail:
-                            task.on_fail()
-                        break
-                    # 重试
-                    task.retry_count += 1
-                    logger.info(f"任务重试 ({task.retry_count}/{task.max_retry}): {task.name}")
-                    if not self._execute_single_task(task):
-                        continue
-                    else:
-                        # 重试成功，继续执行
-                        task.status = QuestStatus.COMPLETED
-                        if task.on_complete:
-                            task.on_complete()
+                    break
+                # 降低优先级后重新入队，先让后面的任务执行
+                heapq.heappush(ready, (key + self.RETRY_PRIORITY_PENALTY, index, task))
 
             # 如果不循环，执行一次后退出
             if not quest.loop:
@@ -175,13 +222,125 @@ class QuestManager:
             # 循环延迟
             if loop_count > 1:
                 logger.info(f"任务链循环，等待 {quest.loop_delay} 秒后重新开始")
-                time.sleep(quest.loop_delay)
+                self._cancel.wait(quest.loop_delay)
+
+        if self._cancel.is_set():
+            logger.info(f"任务链已取消: {quest.quest_name}")
+            success = False
 
         # 记录历史
-        self._record_history(quest, success)
+        self._record_history(quest, success, self._stats_delta(stats_before))
 
         return success
 
+    def execute_quests(self, quest_ids: List[str]) -> bool:
+        """
+        在一次调度中批量执行多个任务链（每个任务链执行一轮，不处理循环设置）
+        所有任务按 (任务链优先级, 任务优先级, 声明顺序) 统一排序执行
+        :param quest_ids: 任务链ID列表
+        :return: 是否全部成功
+        """
+        quests = []
+        for quest_id in quest_ids:
+            quest = self.get_quest(quest_id)
+            if quest:
+                quests.append(quest)
+            else:
+                logger.error(f"任务链不存在: {quest_id}")
+        if not quests:
+            return False
+
+        self._cancel.clear()
+        names = ', '.join(q.quest_name for q in quests)
+        logger.info(f"开始批量执行任务链: {names}")
+        self.game_task.log_info(f"开始批量执行任务链: {names}", notify=True)
+
+        # 所有任务链的任务放入同一个堆
+        ready = []
+        for order, quest in enumerate(quests):
+            self._reset_tasks(quest)
+            for index, task in enumerate(quest.tasks):
+                ready.append((-quest.priority, -task.priority, order, index, quest, task))
+        heapq.heapify(ready)
+
+        results = {quest.quest_id: True for quest in quests}
+        # 各任务链的任务交错执行，统计增量按任务归属分别累计
+        deltas = {quest.quest_id: Counter() for quest in quests}
+        aborted = set()
+        while ready and not self._cancel.is_set():
+            quest_key, task_key, order, index, quest, task = heapq.heappop(ready)
+            if quest.quest_id in aborted:
+                continue
+
+            self.current_quest = quest
+            quest._dirty.add(index)
+            stats_before = dict(self.statistics)
+            success = self._execute_single_task(task)
+            deltas[quest.quest_id].update(self._stats_delta(stats_before))
+            if success:
+                continue
+            if self._defer_or_fail(task, has_other_tasks=bool(ready)):
+                # 降低优先级后重新入队
+                heapq.heappush(ready, (quest_key, task_key + self.RETRY_PRIORITY_PENALTY, order, index, quest, task))
+            else:
+                # 该任务链中止，其余任务链继续
+                results[quest.quest_id] = False
+                aborted.add(quest.quest_id)
+
+        if self._cancel.is_set():
+            logger.info(f"批量任务已取消: {names}")
+            for quest in quests:
+                results[quest.quest_id] = False
+
+        for quest in quests:
+            self._record_history(quest, results[quest.quest_id],
+                                 {key: deltas[quest.quest_id][key] for key in self.statistics})
+
+        return all(results.values())
+
+    @staticmethod
+    def _reset_tasks(quest: QuestConfig):
+        """重置任务链中上次执行过的任务的状态和重试次数，未执行过的任务本来就是待执行状态"""
+        for index in quest._dirty:
+            if index < len(quest.tasks):
+                task = quest.tasks[index]
+                task.status = QuestStatus.PENDING
+                task.retry_count = 0
+        quest._dirty.clear()
+
+    def _defer_or_fail(self, task: QuestTask, has_other_tasks: bool) -> bool:
+        """
+        处理任务失败：还有重试次数时计数并返回 True，由调用方以更低优先级重新入队；
+        重试次数用尽（或已取消）时返回 False，用尽时触发失败回调
+        没有其他任务可以先执行时，按指数退避等待后再重试（0.2秒起，最长5秒）
+        :param task: 任务对象
+        :param has_other_tasks: 队列中是否还有其他任务
+        :return: 是否需要重新入队
+        """
+        if self._cancel.is_set():
+            return False
+        if task.retry_count >= task.max_retry:
+            logger.error(f"任务执行失败，已达最大重试次数: {task.name}")
+            if task.on_fail:
+                task.on_fail()
+            return False
+
+        if not has_other_tasks and self._cancel.wait(min(5.0, 0.2 * 2 ** task.retry_count)):
+            return False
+        task.retry_count += 1
+        logger.info(f"任务延后重试 ({task.retry_count}/{task.max_retry}): {task.name}")
+        return True
+
+    @staticmethod
+    def _build_ready_queue(tasks: List[QuestTask]) -> List[Tuple[int, int, QuestTask]]:
+        """
+        构建就绪队列（最小堆），元素为 (-优先级, 声明顺序, 任务)
+        优先级高的任务先执行，同优先级按声明顺序执行
+        """
+        ready = [(-task.priority, index, task) for index, task in enumerate(tasks)]
+        heapq.heapify(ready)
+        return ready
+
     def _execute_single_task(self, task: QuestTask) -> bool:
         """
         执行单个任务
@@ -191,7 +350,7 @@ class QuestManager:
         self.current_task = task
         self.statistics['total_tasks'] += 1
 
-        logger.info(f"执行任务: {task.name} ({task.task_type.value})")
+        logger.info(f"执行任务: {task.name} ({task._type_str})")
 
         # 检查前置条件
         if task.pre_condition and not task.pre_condition():
@@ -208,6 +367,9 @@ class QuestManager:
 
         # 执行任务逻辑
         try:
+            # 注册后才加入任务链的任务在首次执行时解析参数
+            if task._params is None:
+                self._prepare_task(task)
             result = self._execute_task_by_type(task)
 
             # 检查后置条件
@@ -240,28 +402,15 @@ class QuestManager:
         :param task: 任务对象
         :return: 是否成功
         """
-        start_time = time.time()
-        timeout = task.config.get('timeout', task.timeout)
-
-        if task.task_type == TaskType.GATHERING:
-            return self._execute_gathering_task(task, timeout)
-        elif task.task_type == TaskType.COMBAT:
-            return self._execute_combat_task(task, timeout)
-        elif task.task_type == TaskType.INTERACT:
-            return self._execute_interact_task(task, timeout)
-        elif task.task_type == TaskType.MOVE_TO:
-            return self._execute_move_to_task(task, timeout)
-        elif task.task_type == TaskType.WAIT:
-            return self._execute_wait_task(task)
-        elif task.task_type == TaskType.CUSTOM:
-            # 自定义任务，由config中的executor执行
-            executor = task.config.get('executor')
-            if executor:
-                return executor()
-            return False
-        else:
+        # 自定义任务直接调用解析好的执行函数（_prepare_task 保证自定义任务一定有执行函数）
+        if task._fast_exec is not None:
+            return task._fast_exec()
+
+        handler = self._DISPATCH.get(task.task_type)
+        if handler is None:
             logger.warning(f"未知任务类型: {task.task_type}")
             return False
+        return handler(self, task, task._timeout)
 
     # ==================== 各类型任务执行逻辑 ====================
 
@@ -271,10 +420,11 @@ class QuestManager:
         :param task: 任务对象
         :param timeout: 超时时间
         """
-        resource_name = task.config.get('resource_name')
-        minimap_marker = task.config.get('minimap_marker')
-        gather_count = task.config.get('gather_count', 1)
-        gather_key = task.config.get('gather_key', 'f')
+        params = task._params
+        resource_name = params['resource_name']
+        minimap_marker = params['minimap_marker']
+        gather_count = params['gather_count']
+        gather_key = params['gather_key']
 
         if not resource_name:
             logger.error("采集任务缺少resource_name配置")
@@ -282,10 +432,11 @@ class QuestManager:
 
         logger.info(f"开始采集: {resource_name}, 目标数量: {gather_count}")
 
+        target_found = partial(self._find_gather_target, resource_name)
         gathered = 0
-        start_time = time.time()
+        deadline = time.monotonic() + timeout
 
-        while gathered < gather_count and (time.time() - start_time) < timeout:
+        while gathered < gather_count and time.monotonic() < deadline and not self._should_stop():
             # 检查是否还在采集范围内
             # 1. 在小地图上查找资源标记
             if minimap_marker:
@@ -295,17 +446,13 @@ class QuestManager:
                     return False
 
             # 2. 在屏幕上查找采集目标
-            if self.game_task.wait_until(lambda: self._find_gather_target(resource_name), timeout=10):
-                # 3. 点击目标
-                self.game_task.click_target(resource_name)
-                time.sleep(0.5)
-
-                # 4. 采集
-                self.game_task.operate(lambda: self.game_task.send_key(gather_key))
+            if self.game_task.wait_until(target_found, timeout=10):
+                # 3. 点击目标并采集
+                self._click_and_press(resource_name, gather_key)
                 logger.info(f"采集中... ({gathered + 1}/{gather_count})")
 
                 # 5. 等待采集完成（检测采集进度条或等待固定时间）
-                time.sleep(3)
+                self.game_task.sleep(3)
                 gathered += 1
             else:
                 logger.warning(f"未找到采集目标: {resource_name}")
@@ -320,9 +467,10 @@ class QuestManager:
         :param task: 任务对象
         :param timeout: 超时时间
         """
-        target_name = task.config.get('target_name')
-        skill_sequence = task.config.get('skill_sequence', ['1', '2', '3'])
-        kill_count = task.config.get('kill_count', 1)
+        params = task._params
+        target_name = params['target_name']
+        skill_sequence = params['skill_sequence']
+        kill_count = params['kill_count']
 
         if not target_name:
             logger.error("战斗任务缺少target_name配置")
@@ -330,30 +478,30 @@ class QuestManager:
 
         logger.info(f"开始战斗: {target_name}, 目标击杀数: {kill_count}")
 
+        enemy_found = partial(self._find_enemy, target_name)
+        in_combat = self.game_task.is_in_combat
         killed = 0
-        start_time = time.time()
+        deadline = time.monotonic() + timeout
 
-        while killed < kill_count and (time.time() - start_time) < timeout:
+        while killed < kill_count and time.monotonic() < deadline and not self._should_stop():
             # 1. 查找敌人
-            if self.game_task.wait_until(lambda: self._find_enemy(target_name), timeout=10):
+            if self.game_task.wait_until(enemy_found, timeout=10):
                 # 2. 锁定并攻击
                 self.game_task.click_target(target_name)
-                time.sleep(0.5)
+                self.game_task.sleep(0.5)
 
-                # 3. 释放技能循环
-                while self.game_task.is_in_combat() and (time.time() - start_time) < timeout:
+                # 3. 释放技能循环：每轮只检测一次战斗状态，到达截止时间、超时或取消时立即结束
+                while time.monotonic() < deadline and not self._should_stop() and in_combat():
                     for skill in skill_sequence:
-                        if self.game_task.is_in_combat():
-                            self.game_task.cast_skill(skill)
-                        else:
-                            break
-                    time.sleep(0.5)
+                        self.game_task.wait_skill_ready()
+                        self.game_task.cast_skill(skill)
+                    self.game_task.sleep(0.5)
 
                 # 4. 等待战斗结束
-                time.sleep(2)
+                self.game_task.sleep(2)
 
                 # 5. 检查敌人是否死亡
-                if not self._find_enemy(target_name):
+                if not enemy_found():
                     killed += 1
                     logger.info(f"击杀敌人 ({killed}/{kill_count})")
             else:
@@ -369,8 +517,9 @@ class QuestManager:
         :param task: 任务对象
         :param timeout: 超时时间
         """
-        target_name = task.config.get('target_name')
-        interact_key = task.config.get('interact_key', 'f')
+        params = task._params
+        target_name = params['target_name']
+        interact_key = params['interact_key']
 
         if not target_name:
             logger.error("交互任务缺少target_name配置")
@@ -379,14 +528,10 @@ class QuestManager:
         logger.info(f"开始交互: {target_name}")
 
         # 查找交互目标
-        if self.game_task.wait_until(lambda: self.game_task.find_one(target_name), timeout=timeout):
-            # 点击目标
-            self.game_task.click_target(target_name)
-            time.sleep(0.5)
-
-            # 交互
-            self.game_task.operate(lambda: self.game_task.send_key(interact_key))
-            time.sleep(1)
+        if self.game_task.wait_until(partial(self._cached_find, target_name), timeout=timeout):
+            # 点击目标并交互
+            self._click_and_press(target_name, interact_key)
+            self.game_task.sleep(1)
 
             logger.info(f"交互完成: {target_name}")
             return True
@@ -401,7 +546,7 @@ class QuestManager:
         :param timeout: 超时时间
         """
         # 移动到指定位置（可以结合任务追踪自动寻路）
-        quest_index = task.config.get('quest_index', 0)
+        quest_index = task._params['quest_index']
 
         # 点击任务追踪
         self.game_task.click_quest_track(quest_index)
@@ -416,57 +561,97 @@ class QuestManager:
         logger.info("移动任务完成")
         return True
 
-    def _execute_wait_task(self, task: QuestTask) -> bool:
+    def _execute_wait_task(self, task: QuestTask, timeout: float) -> bool:
         """
         执行等待任务
         :param task: 任务对象
+        :param timeout: 超时时间（未使用，保持与其他任务类型一致的签名）
         """
-        wait_time = task.config.get('wait_time', 1.0)
+        wait_time = task._params['wait_time']
         logger.info(f"等待 {wait_time} 秒")
-        time.sleep(wait_time)
-        return True
+        return not self._cancel.wait(wait_time)
+
+    # 任务类型 -> 执行方法，类定义时构建一次
+    _DISPATCH: Dict[TaskType, Callable[['QuestManager', QuestTask, float], bool]] = {
+        TaskType.GATHERING: _execute_gathering_task,
+        TaskType.COMBAT: _execute_combat_task,
+        TaskType.INTERACT: _execute_interact_task,
+        TaskType.MOVE_TO: _execute_move_to_task,
+        TaskType.WAIT: _execute_wait_task,
+    }
 
     # ==================== 辅助方法 ====================
 
+    def _should_stop(self) -> bool:
+        """当前任务是否应提前结束（已取消）"""
+        return self._cancel.is_set()
+
+    def _click_and_press(self, target_name: str, key: str):
+        """
+        点击目标，等待角色走到目标后按键
+        等待放在操作锁外，只有按键占用操作锁
+        :param target_name: 目标名称
+        :param key: 按键
+        """
+        self.game_task.click_target(target_name)
+        self.game_task.sleep(0.5)
+        self.game_task.operate(lambda: self.game_task.send_key(key))
+
+    def _cached_find(self, name: str, ttl_ms: int = 300):
+        """
+        带短时缓存的模板查找，同一时间桶内的重复查找直接复用结果
+        :param name: 模板名称
+        :param ttl_ms: 时间桶长度（毫秒）
+        """
+        bucket = time.monotonic_ns() // (ttl_ms * 1_000_000)
+        key = (name, bucket)
+        if key not in self._find_cache:
+            # 只保留最近两个时间桶的结果
+            for stale in [k for k in self._find_cache if k[1] < bucket - 1]:
+                del self._find_cache[stale]
+            self._find_cache[key] = self.game_task.find_one(name)
+        return self._find_cache[key]
+
     def _find_gather_target(self, resource_name: str) -> bool:
         """查找采集目标"""
-        return self.game_task.find_one(resource_name) is not None
+        return self._cached_find(resource_name) is not None
 
     def _find_enemy(self, target_name: str) -> bool:
         """查找敌人"""
-        return self.game_task.find_one(target_name) is not None
+        return self._cached_find(target_name) is not None
+
+    def _stats_delta(self, before: Dict[str, int]) -> Dict[str, int]:
+        """当前统计值相对 before 的增量"""
+        return {key: value - before[key] for key, value in self.statistics.items()}
 
-    def _record_history(self, quest: QuestConfig, success: bool):
-        """记录任务执行历史"""
-        record = {
+    def _record_history(self, quest: QuestConfig, success: bool, stats_delta: Dict[str, int]):
+        """
+        记录任务执行历史
+        :param quest: 任务链
+        :param success: 是否成功
+        :param stats_delta: 本次执行该任务链带来的统计增量
+        """
+        self.quest_history.append({
             'quest_id': quest.quest_id,
             'quest_name': quest.quest_name,
             'timestamp': time.time(),
             'success': success,
-            'statistics': self.statistics.copy()
-        }
-        self.quest_history.append(record)
-
-        # 保持历史记录不超过100条
-        if len(self.quest_history) > 100:
-            self.quest_history = self.quest_history[-100:]
+            'statistics_delta': stats_delta
+        })
 
     def get_statistics(self) -> Dict:
-        """获取统计信息"""
+        """获取统计信息（副本），频繁轮询请直接读取 statistics_view"""
         return self.statistics.copy()
 
     def reset_statistics(self):
-        """重置统计信息"""
-        self.statistics = {
-            'total_tasks': 0,
-            'completed_tasks': 0,
-            'failed_tasks': 0,
-            'skipped_tasks': 0
-        }
+        """重置统计信息（原地清零，statistics_view 保持有效）"""
+        for key in self.statistics:
+            self.statistics[key] = 0
 
     def stop_current_execution(self):
         """停止当前任务执行"""
         logger.info("停止任务执行")
-        # 可以通过设置标志位来中断执行
+        # 执行循环在下一个检测点看到取消标志后退出
+        self._cancel.set()
         self.current_quest = None
         self.current_task = None
@@ -3,16 +3,37 @@
 """
 import re
 import time
-from typing import Optional, Tuple
+from typing import Callable, Dict, Optional, Tuple
 from enum import Enum
 from dataclasses import dataclass
 
 from qfluentwidgets import FluentIcon
 
-from src.tasks.BaseGameTask import BaseGameTask, GameState
+from src.tasks.BaseGameTask import BaseGameTask, GameState, cached_compile
 from src.tasks.GatheringTask import GatheringTask
 from src.tasks.CombatTask import CombatTask
 
+# 任务栏/日程中识别师门任务的关键字
+SHIMEN_KEYWORD = '师门'
+# 日程中师门任务已完成的文字匹配（直接绑定search方法，省去每次属性查找）
+_search_completed = re.compile(r'已完成|完成|领取').search
+
+# 资源名称到图片模板ID的映射（需要根据游戏实际配置）
+RESOURCE_TEMPLATE_IDS = {
+    '铁矿': 'ore_iron',
+    '铜矿': 'ore_copper',
+    '草药': 'herb_basic',
+    '木材': 'wood_basic',
+    # 添加更多映射...
+}
+
+# 敌人名称到图片模板ID的映射
+ENEMY_TEMPLATE_IDS = {
+    '野猪': 'enemy_boar',
+    '狼': 'enemy_wolf',
+    # 添加更多映射...
+}
+
 
 class TaskType(Enum):
     """任务类型"""
@@ -22,6 +43,27 @@ class TaskType(Enum):
     UNKNOWN = "unknown"     # 未知类型
 
 
+# 任务动词到任务类型的映射，新增动词只需在这里添加
+TASK_VERBS = {
+    '消灭': TaskType.COMBAT,
+    '击杀': TaskType.COMBAT,
+    '讨伐': TaskType.COMBAT,
+    '采集': TaskType.GATHERING,
+    '收集': TaskType.GATHERING,
+    '获取': TaskType.GATHERING,
+    '交给': TaskType.DELIVERY,
+    '拜访': TaskType.DELIVERY,
+    '寻找': TaskType.DELIVERY,
+}
+
+# 任务描述解析：一次匹配同时得到任务动词、目标名称和数量
+# 目标名称用排除字符类贪婪匹配到数字/括号/行尾为止，不回溯，OCR乱码也是线性时间
+TASK_PATTERN = re.compile(
+    '(?P<verb>' + '|'.join(map(re.escape, TASK_VERBS)) + ')'
+    r'(?P<target>[^\d\n(（]+)(?P<count>\d+)?'
+)
+
+
 class ShimenState(Enum):
     """师门任务状态"""
     IDLE = "idle"               # 空闲
@@ -33,7 +75,7 @@ class ShimenState(Enum):
     FINISHED = "finished"       # 完成
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ShimenTaskInfo:
     """师门任务信息"""
     task_name: str          # 任务名称
@@ -42,6 +84,17 @@ class ShimenTaskInfo:
     target_count: int = 1   # 目标数量
 
 
+@dataclass(slots=True, frozen=True)
+class _RunCtx:
+    """师门流程各步骤共用的配置，run 开始时读取一次，默认值见 default_config"""
+    max_rounds: int                       # 最大执行轮数
+    operation_delay: float                # 每次操作间隔（秒）
+    hp_threshold: float                   # 血量低于该百分比使用血药
+    schedule_delay: float                 # 打开日程后的等待时间（秒）
+    hp_potion_key: str                    # 血药快捷键
+    skill_sequence: Tuple[str, ...]       # 战斗技能顺序
+
+
 class ShimenTask(BaseGameTask):
     """
     师门任务
@@ -79,17 +132,29 @@ class ShimenTask(BaseGameTask):
             '任务失败重试次数': 3,
             '每次操作间隔(秒)': 1.5,
             '日程检查间隔(秒)': 2.0,
+            '血药快捷键': '0',
+            '技能释放顺序': '1-2-3',
         })
 
         # 子任务实例（复用）
         self.gathering_task = GatheringTask(*args, **kwargs)
         self.combat_task = CombatTask(*args, **kwargs)
 
-        # 当前状态
-        self.current_state = ShimenState.IDLE
+        # 当前状态（current_state 是基类的游戏状态缓存，这里单独记录师门流程状态）
+        self.shimen_state = ShimenState.IDLE
         self.completed_rounds = 0
         self.current_task_info: Optional[ShimenTaskInfo] = None
 
+        # 配置快照，每次运行开始时从配置读取
+        self._ctx: Optional[_RunCtx] = None
+
+        # 查找敌人/NPC未找到的结果在有效期内直接复用，等待循环中不重复识别
+        self.miss_ttl = 0.2  # 未找到结果的有效期（秒）
+        self._miss_until: Dict[Tuple[str, str], float] = {}
+
+        # 确认类按钮上次出现的位置，下次先在附近小范围查找
+        self._confirm_pos: Dict[str, Tuple[float, float]] = {}
+
         # 统计信息
         self.statistics = {
             'total_rounds': 0,
@@ -102,14 +167,19 @@ class ShimenTask(BaseGameTask):
     def run(self):
         """任务执行入口"""
         self.log_info('师门任务开始', notify=True)
+        self._stop_event.clear()
 
-        import time
-        start_time = time.time()
+        start_time = time.monotonic()
 
         try:
-            max_rounds = self.config.get('最大任务轮数', 20)
-            operation_delay = self.config.get('每次操作间隔(秒)', 1.5)
-            hp_threshold = self.config.get('血量低于%逃离', 30)
+            ctx = self._ctx = _RunCtx(
+                max_rounds=self.config.get('最大任务轮数'),
+                operation_delay=self.config.get('每次操作间隔(秒)'),
+                hp_threshold=self.config.get('血量低于%逃离'),
+                schedule_delay=self.config.get('日程检查间隔(秒)'),
+                hp_potion_key=self.config.get('血药快捷键'),
+                skill_sequence=tuple(self.config.get('技能释放顺序').split('-')),
+            )
 
             # 重置统计
             self.statistics = {
@@ -120,23 +190,34 @@ class ShimenTask(BaseGameTask):
                 'total_time': 0
             }
 
+            # 刚提交完一轮时任务栏可能还没刷新，首次检测为空先不开日程，再确认一次
+            recheck_before_schedule = False
+
             # 主循环
-            while self.completed_rounds < max_rounds:
-                # 检查角色状态
-                state = self.check_game_state()
-                if state == GameState.DEAD:
+            while self.completed_rounds < ctx.max_rounds and not self._stop_event.is_set():
+                # 检查角色状态，状态和血量在同一帧上一次采样
+                status = self.sample_player_status()
+                if status.state == GameState.DEAD:
                     self.log_error("角色已死亡，停止任务")
                     break
 
-                if self.check_hp_low(hp_threshold):
+                if status.hp_pct < ctx.hp_threshold:
                     self.log_warn("血量过低，使用血药")
                     self._use_hp_potion()
-                    time.sleep(2)
+                    self.sleep(2)
 
                 # 步骤1: 检查任务栏是否有师门任务
-                self.current_state = ShimenState.CHECKING_TASK
+                self.shimen_state = ShimenState.CHECKING_TASK
                 has_task = self._check_shimen_task_in_list()
 
+                if not has_task and recheck_before_schedule:
+                    recheck_before_schedule = False
+                    self.log_debug("任务栏暂无师门任务，等待刷新后再确认")
+                    if self._wait_with_status_monitor(ctx.operation_delay, ctx.hp_threshold, self._use_hp_potion):
+                        break
+                    continue
+
+                recheck_before_schedule = False
                 if not has_task:
                     # 任务栏没有师门任务，去日程检查
                     self.log_info("任务栏没有师门任务，检查日程...")
@@ -147,15 +228,16 @@ class ShimenTask(BaseGameTask):
                         self.log_info("师门任务全部完成！", notify=True)
                         break
 
-                    # 等待任务出现
-                    time.sleep(operation_delay)
+                    # 等待任务出现，等待期间继续监控血量
+                    if self._wait_with_status_monitor(ctx.operation_delay, ctx.hp_threshold, self._use_hp_potion):
+                        break
                     continue
 
                 # 步骤2: 解析任务信息
                 task_info = self._parse_shimen_task()
                 if not task_info:
                     self.log_warn("无法解析任务信息，重试...")
-                    time.sleep(operation_delay)
+                    self.sleep(ctx.operation_delay)
                     continue
 
                 self.current_task_info = task_info
@@ -164,33 +246,37 @@ class ShimenTask(BaseGameTask):
                 # 步骤3: 点击任务追踪前往
                 self.log_info("点击任务追踪前往...")
                 self.click_quest_track(0)  # 点击第一个任务
-                time.sleep(operation_delay)
+                self.sleep(ctx.operation_delay)
 
                 # 步骤4: 执行任务
-                self.current_state = ShimenState.EXECUTING
+                self.shimen_state = ShimenState.EXECUTING
                 success = self._execute_task(task_info)
 
                 if not success:
                     self.log_warn("任务执行失败，重试...")
                     # 简单重试：重新点击任务追踪
-                    time.sleep(2)
+                    self.sleep(2)
                     continue
 
                 # 步骤5: 返回提交任务
-                self.current_state = ShimenState.SUBMITTING
+                self.shimen_state = ShimenState.SUBMITTING
                 self.log_info("返回提交任务...")
                 self._submit_task()
 
                 # 等待任务更新
-                time.sleep(operation_delay)
+                self.sleep(ctx.operation_delay)
 
                 # 完成一轮
                 self.completed_rounds += 1
                 self.statistics['total_rounds'] += 1
                 self.log_info(f"完成第 {self.completed_rounds} 轮任务")
+                recheck_before_schedule = True
+
+            if self._stop_event.is_set():
+                self.log_info("收到停止请求，结束师门任务")
 
             # 显示统计
-            self.statistics['total_time'] = time.time() - start_time
+            self.statistics['total_time'] = time.monotonic() - start_time
             self._show_statistics()
 
         except Exception as e:
@@ -199,21 +285,37 @@ class ShimenTask(BaseGameTask):
         finally:
             self.log_info('师门任务结束', notify=True)
 
+    def request_stop(self):
+        """请求停止任务，同时通知正在执行的子任务"""
+        super().request_stop()
+        self.gathering_task.request_stop()
+        self.combat_task.request_stop()
+
     # ==================== 任务检查 ====================
 
+    def _ocr_text(self, box=None) -> str:
+        """
+        OCR识别区域内全部文字，每个识别结果一行
+        :param box: 识别区域，None表示全屏
+        """
+        boxes = self.ocr(box=box, log=False)
+        return '\n'.join(box.name for box in boxes) if boxes else ''
+
+    def _read_quest_list(self) -> str:
+        """任务栏文字，同一tick内复用，检查任务和解析任务共用一次识别"""
+        return self._cached('quest_list', lambda: self._ocr_text(self.quest_list_area))
+
+    def _read_schedule(self) -> str:
+        """日程界面文字，同一tick内复用，查找师门和判断完成共用一次识别"""
+        return self._cached('schedule', self._ocr_text)
+
     def _check_shimen_task_in_list(self) -> bool:
         """
         检查任务栏是否有师门任务
         :return: 是否有师门任务
         """
-        # 方法1: OCR识别任务栏中的"师门任务"文字
-        result = self.ocr(
-            box=self.quest_list_area,
-            match=re.compile(r'师门'),
-            log=False
-        )
-
-        if result:
+        # 方法1: 任务栏文字中查找"师门任务"
+        if SHIMEN_KEYWORD in self._read_quest_list():
             self.log_debug("找到师门任务")
             return True
 
@@ -229,51 +331,29 @@ class ShimenTask(BaseGameTask):
         解析师门任务信息
         :return: 任务信息
         """
-        # OCR识别任务名称
-        task_text = self.ocr(
-            box=self.quest_list_area,
-            log=False
-        )
+        # 复用本轮检查任务时的识别结果
+        task_text = self._read_quest_list()
 
         if not task_text:
             return None
 
         self.log_debug(f"任务文字: {task_text}")
 
-        # 解析任务类型和目标
-        task_type = TaskType.UNKNOWN
-        target_name = ""
-        task_name = task_text
-
-        # 匹配 "消灭xxx" 或 "击杀xxx"
-        combat_match = re.search(r'(消灭|击杀|讨伐)(.+?)(\d+)?个?', task_text)
-        if combat_match:
-            task_type = TaskType.COMBAT
-            target_name = combat_match.group(2).strip()
-            self.statistics['combat_tasks'] += 1
-
-        # 匹配 "采集xxx" 或 "收集xxx"
-        gather_match = re.search(r'(采集|收集|获取)(.+?)(\d+)?个?', task_text)
-        if gather_match:
-            task_type = TaskType.GATHERING
-            target_name = gather_match.group(2).strip()
-            self.statistics['gathering_tasks'] += 1
-
-        # 匹配 "交给xxx" 或 "拜访xxx"
-        delivery_match = re.search(r'(交给|拜访|寻找)(.+?)(\d+)?个?', task_text)
-        if delivery_match:
-            task_type = TaskType.DELIVERY
-            target_name = delivery_match.group(2).strip()
-            self.statistics['delivery_tasks'] += 1
-
-        if task_type == TaskType.UNKNOWN:
+        # 解析任务类型和目标（单次匹配，由动词查表得到类型）
+        match = TASK_PATTERN.search(task_text)
+        if not match:
             self.log_warn(f"无法识别任务类型: {task_text}")
             return None
 
+        task_type = TASK_VERBS[match.group('verb')]
+        self.statistics[f'{task_type.value}_tasks'] += 1
+
+        count = match.group('count')
         return ShimenTaskInfo(
-            task_name=task_name,
+            task_name=match.group(0),
             task_type=task_type,
-            target_name=target_name
+            target_name=match.group('target').strip(),
+            target_count=int(count) if count else 1
         )
 
     # ==================== 任务执行 ====================
@@ -284,15 +364,11 @@ class ShimenTask(BaseGameTask):
         :param task_info: 任务信息
         :return: 是否成功
         """
-        if task_info.task_type == TaskType.COMBAT:
-            return self._execute_combat_task(task_info)
-        elif task_info.task_type == TaskType.GATHERING:
-            return self._execute_gathering_task(task_info)
-        elif task_info.task_type == TaskType.DELIVERY:
-            return self._execute_delivery_task(task_info)
-        else:
+        handler = self._DISPATCH.get(task_info.task_type)
+        if handler is None:
             self.log_warn(f"未知任务类型: {task_info.task_type}")
             return False
+        return handler(self, task_info)
 
     def _execute_combat_task(self, task_info: ShimenTaskInfo) -> bool:
         """
@@ -302,12 +378,12 @@ class ShimenTask(BaseGameTask):
         self.log_info(f"执行战斗任务: {task_info.target_name}")
 
         # 点击任务追踪后，等待到达战斗地点
-        time.sleep(3)
+        self.sleep(3)
 
-        # 查找敌人
-        enemy_found = self.wait_until(
+        # 查找敌人（退避检测，找到即返回）
+        enemy_found = self.wait_with_backoff(
             lambda: self._find_enemy_by_name(task_info.target_name),
-            timeout=15
+            timeout=15, initial_delay=0.1, max_delay=1.0
         )
 
         if not enemy_found:
@@ -316,25 +392,25 @@ class ShimenTask(BaseGameTask):
 
         # 战斗
         max_combat_time = 120  # 最大战斗时间
-        start_time = time.time()
+        deadline = time.monotonic() + max_combat_time
 
-        while time.time() - start_time < max_combat_time:
+        while time.monotonic() < deadline and not self._stop_event.is_set():
             if not self.is_in_combat():
-                # 战斗结束，检查是否还需要继续
-                time.sleep(2)
-                if not self.is_in_combat():
+                # 战斗结束，2秒内没有再次进入战斗才算完成，再次进战立即继续
+                if not self.wait_with_backoff(self.is_in_combat, timeout=2,
+                                              initial_delay=0.1, max_delay=1.0):
                     self.log_info("战斗完成")
                     return True
 
             # 释放技能
-            skill_sequence = self.config.get('技能释放顺序', '1-2-3').split('-')
-            for skill in skill_sequence:
+            for skill in self._ctx.skill_sequence:
                 if self.is_in_combat():
+                    self.wait_skill_ready()
                     self.cast_skill(skill)
                 else:
                     break
 
-            time.sleep(0.5)
+            self.sleep(0.5)
 
         self.log_warn("战斗超时")
         return False
@@ -347,7 +423,7 @@ class ShimenTask(BaseGameTask):
         self.log_info(f"执行采集任务: {task_info.target_name}")
 
         # 点击任务追踪后，等待到达采集地点
-        time.sleep(3)
+        self.sleep(3)
 
         # 查找采集目标
         # 尝试匹配目标名称对应的图片模板
@@ -355,9 +431,9 @@ class ShimenTask(BaseGameTask):
 
         gather_count = 0
         max_gather_time = 120
-        start_time = time.time()
+        deadline = time.monotonic() + max_gather_time
 
-        while time.time() - start_time < max_gather_time:
+        while time.monotonic() < deadline and not self._stop_event.is_set():
             # 查找采集目标
             if resource_id:
                 pos = self.find_one(resource_id)
@@ -367,17 +443,17 @@ class ShimenTask(BaseGameTask):
 
             if not pos:
                 self.log_debug("未找到采集目标，等待...")
-                time.sleep(2)
+                self.sleep(2)
                 continue
 
             # 点击采集
             self.click(pos[0], pos[1])
-            time.sleep(0.5)
+            self.sleep(0.5)
 
             # 按F采集
             self.interact()
             self.log_info("采集中...")
-            time.sleep(3)
+            self.sleep(3)
 
             gather_count += 1
 
@@ -398,12 +474,12 @@ class ShimenTask(BaseGameTask):
         self.log_info(f"执行递交任务: {task_info.target_name}")
 
         # 点击任务追踪后，等待到达NPC位置
-        time.sleep(3)
+        self.sleep(3)
 
-        # 查找NPC
-        npc_found = self.wait_until(
+        # 查找NPC（退避检测，找到即返回）
+        npc_found = self.wait_with_backoff(
             lambda: self._find_npc_by_name(task_info.target_name),
-            timeout=15
+            timeout=15, initial_delay=0.1, max_delay=1.0
         )
 
         if not npc_found:
@@ -413,22 +489,21 @@ class ShimenTask(BaseGameTask):
         # 点击NPC对话
         self.log_info("与NPC对话...")
         self.interact()
-        time.sleep(2)
+        self.sleep(2)
 
         # 提交任务（通常需要点击对话框中的提交按钮）
-        # 查找"提交"、"确定"等按钮
-        submit_button = self.find_one('submit_button', threshold=0.7)
-        if submit_button:
-            self.click(submit_button[0], submit_button[1])
-            time.sleep(1)
-        else:
-            # 按F或Enter提交
-            self.send_key('enter')
-            time.sleep(1)
+        self._press_confirm()
 
         self.log_info("递交完成")
         return True
 
+    # 任务类型 -> 执行函数
+    _DISPATCH: Dict[TaskType, Callable[['ShimenTask', ShimenTaskInfo], bool]] = {
+        TaskType.COMBAT: _execute_combat_task,
+        TaskType.GATHERING: _execute_gathering_task,
+        TaskType.DELIVERY: _execute_delivery_task,
+    }
+
     # ==================== 任务提交 ====================
 
     def _submit_task(self):
@@ -436,23 +511,49 @@ class ShimenTask(BaseGameTask):
         # 返回NPC处提交
         # 通常点击任务追踪就会自动返回
         self.click_quest_track(0)
-        time.sleep(3)
+        self.sleep(3)
 
         # 与NPC对话提交
         self.interact()
-        time.sleep(2)
+        self.sleep(2)
 
         # 点击提交按钮
-        submit_button = self.find_one('submit_button', threshold=0.7)
-        if submit_button:
-            self.click(submit_button[0], submit_button[1])
-            time.sleep(1)
-        else:
-            self.send_key('enter')
-            time.sleep(1)
+        self._press_confirm()
 
         self.log_info("任务已提交")
 
+    def _press_confirm(self, template: str = 'submit_button', fallback_key: str = 'enter',
+                       margin: float = 0.08) -> bool:
+        """
+        点击对话框中的确认类按钮，找不到按钮时按键代替
+        按钮位置通常固定，先在上次出现的位置附近查找，找不到再全屏查找
+        :param template: 按钮模板名称
+        :param fallback_key: 找不到按钮时按下的键
+        :param margin: 附近查找范围（相对屏幕比例）
+        :return: 是否找到并点击了按钮
+        """
+        button = None
+        last = self._confirm_pos.get(template)
+        if last is not None:
+            area = {
+                'x_start': max(0.0, last[0] - margin),
+                'x_end': min(1.0, last[0] + margin),
+                'y_start': max(0.0, last[1] - margin),
+                'y_end': min(1.0, last[1] + margin),
+            }
+            button = self.find_one(template, box=area, threshold=0.7)
+        if button is None:
+            button = self.find_one(template, threshold=0.7)
+
+        if button is not None:
+            # 记录按钮中心的相对坐标，下次据此确定附近查找范围
+            self._confirm_pos[template] = self._box_center(button)
+            self.click_box(button)
+        else:
+            self.send_key(fallback_key)
+        self.sleep(1)
+        return button is not None
+
     # ==================== 日程检查 ====================
 
     def _check_schedule_and_accept(self) -> bool:
@@ -460,12 +561,12 @@ class ShimenTask(BaseGameTask):
         检查日程并接取任务
         :return: 是否成功接取（True=继续，False=已完成停止）
         """
-        self.current_state = ShimenState.CHECKING_SCHEDULE
+        self.shimen_state = ShimenState.CHECKING_SCHEDULE
 
         # 打开日程表
         self.log_info("打开日程表...")
         self._open_schedule()
-        time.sleep(self.config.get('日程检查间隔(秒)', 2.0))
+        self.sleep(self._ctx.schedule_delay)
 
         # 下拉寻找师门任务
         self.log_info("查找师门任务...")
@@ -494,32 +595,27 @@ class ShimenTask(BaseGameTask):
         """打开日程表"""
         # 方法1: 按快捷键打开日程
         self.send_key('l')  # 假设L键打开日程
-        time.sleep(0.5)
+        self.sleep(0.5)
 
         # 方法2: 点击日程按钮图标
         schedule_button = self.find_one('schedule_button')
         if schedule_button:
             self.click(schedule_button[0], schedule_button[1])
-            time.sleep(0.5)
+            self.sleep(0.5)
 
     def _close_schedule(self):
         """关闭日程表"""
         # 按ESC关闭
         self.send_key('escape')
-        time.sleep(0.5)
+        self.sleep(0.5)
 
     def _find_shimen_in_schedule(self) -> bool:
         """
         在日程中查找师门任务
         :return: 是否找到
         """
-        # 方法1: OCR识别"师门任务"文字
-        result = self.ocr(
-            match=re.compile(r'师门'),
-            log=False
-        )
-
-        if result:
+        # 方法1: 日程文字中查找"师门任务"
+        if SHIMEN_KEYWORD in self._read_schedule():
             return True
 
         # 方法2: 模板匹配师门任务图标
@@ -531,13 +627,8 @@ class ShimenTask(BaseGameTask):
         检查师门任务是否已完成
         :return: 是否已完成
         """
-        # OCR识别"已完成"文字
-        result = self.ocr(
-            match=re.compile(r'已完成|完成|领取'),
-            log=False
-        )
-
-        return result is not None
+        # 日程文字中查找"已完成"
+        return _search_completed(self._read_schedule()) is not None
 
     def _click_accept_button(self) -> bool:
         """
@@ -549,7 +640,7 @@ class ShimenTask(BaseGameTask):
         if accept_button:
             self.click(accept_button[0], accept_button[1])
             self.log_info("已点击参与按钮")
-            time.sleep(1)
+            self.sleep(1)
             return True
 
         # 方法2: OCR识别"参与"文字并点击
@@ -559,15 +650,35 @@ class ShimenTask(BaseGameTask):
 
     # ==================== 辅助方法 ====================
 
+    def _find_with_miss_cache(self, key: Tuple[str, str], find) -> bool:
+        """
+        查找结果为未找到时记住一小段时间，有效期内再查直接返回False
+        找到的结果不缓存，找到后马上要交互，必须用最新画面
+        :param key: 缓存键（查找类型, 名称）
+        :param find: 实际查找函数
+        """
+        now = time.monotonic()
+        if self._miss_until.get(key, 0.0) > now:
+            return False
+        found = find()
+        if found:
+            self._miss_until.pop(key, None)
+        else:
+            self._miss_until[key] = now + self.miss_ttl
+        return found
+
     def _find_enemy_by_name(self, enemy_name: str) -> bool:
         """根据名称查找敌人"""
-        # 尝试使用模板匹配
-        enemy_id = self._get_enemy_id_by_name(enemy_name)
-        if enemy_id:
-            return self.find_one(enemy_id) is not None
+        def find():
+            # 尝试使用模板匹配
+            enemy_id = self._get_enemy_id_by_name(enemy_name)
+            if enemy_id:
+                return self._cached_find_one(enemy_id) is not None
 
-        # 使用OCR识别
-        return self.ocr(match=re.compile(enemy_name), log=False) is not None
+            # 使用OCR识别（名称按字面匹配，编译结果缓存复用）
+            return bool(self._cached_ocr(cached_compile(re.escape(enemy_name))))
+
+        return self._find_with_miss_cache(('enemy', enemy_name), find)
 
     def _find_gather_target_by_ocr(self, target_name: str) -> Optional[Tuple[float, float]]:
         """使用OCR查找采集目标"""
@@ -578,51 +689,41 @@ class ShimenTask(BaseGameTask):
     def _find_npc_by_name(self, npc_name: str) -> bool:
         """根据名称查找NPC"""
         # NPC头上通常有名字标注
-        return self.ocr(match=re.compile(npc_name), log=False) is not None
+        return self._find_with_miss_cache(
+            ('npc', npc_name),
+            lambda: bool(self._cached_ocr(cached_compile(re.escape(npc_name))))
+        )
 
     def _get_resource_id_by_name(self, resource_name: str) -> Optional[str]:
         """
         根据资源名称获取对应的图片模板ID
         需要根据游戏实际配置
         """
-        # 资源名称到模板ID的映射
-        resource_mapping = {
-            '铁矿': 'ore_iron',
-            '铜矿': 'ore_copper',
-            '草药': 'herb_basic',
-            '木材': 'wood_basic',
-            # 添加更多映射...
-        }
-
-        return resource_mapping.get(resource_name)
+        return RESOURCE_TEMPLATE_IDS.get(resource_name)
 
     def _get_enemy_id_by_name(self, enemy_name: str) -> Optional[str]:
         """
         根据敌人名称获取对应的图片模板ID
         """
-        enemy_mapping = {
-            '野猪': 'enemy_boar',
-            '狼': 'enemy_wolf',
-            # 添加更多映射...
-        }
-
-        return enemy_mapping.get(enemy_name)
+        return ENEMY_TEMPLATE_IDS.get(enemy_name)
 
     def _use_hp_potion(self):
         """使用血药"""
-        key = self.config.get('血药快捷键', '0')
-        self.cast_skill(key)
-        time.sleep(1)
+        self.wait_skill_ready()
+        self.cast_skill(self._ctx.hp_potion_key)
+        self.sleep(1)
 
     def _show_statistics(self):
         """显示统计信息"""
         stats = self.statistics
-        self.log_info("=" * 40)
-        self.log_info("师门任务统计")
-        self.log_info("=" * 40)
-        self.log_info(f"总任务数: {stats['total_rounds']}")
-        self.log_info(f"战斗任务: {stats['combat_tasks']}")
-        self.log_info(f"采集任务: {stats['gathering_tasks']}")
-        self.log_info(f"递交任务: {stats['delivery_tasks']}")
-        self.log_info(f"总耗时: {stats['total_time']:.1f}秒")
-        self.log_info("=" * 40)
+        self.log_info("\n".join([
+            "=" * 40,
+            "师门任务统计",
+            "=" * 40,
+            f"总任务数: {stats['total_rounds']}",
+            f"战斗任务: {stats['combat_tasks']}",
+            f"采集任务: {stats['gathering_tasks']}",
+            f"递交任务: {stats['delivery_tasks']}",
+            f"总耗时: {stats['total_time']:.1f}秒",
+            "=" * 40,
+        ]))
@@ -0,0 +1,129 @@
+# Test case
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from src.tasks.QuestManager import QuestConfig, QuestManager, QuestStatus, QuestTask, TaskType
+
+
+def custom_task(task_id, executor, **kwargs):
+    """构建自定义任务，executor 返回是否成功"""
+    return QuestTask(task_id=task_id, task_type=TaskType.CUSTOM, name=task_id,
+                     config={'executor': executor}, **kwargs)
+
+
+class TestQuestManager(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = QuestManager(MagicMock())
+        self.calls = []
+
+    def recorder(self, name, results=None):
+        """记录调用顺序，按 results 依次返回结果，用完后一直返回 True"""
+        results = list(results or [])
+
+        def executor():
+            self.calls.append(name)
+            return results.pop(0) if results else True
+
+        return executor
+
+    def test_failed_task_deferred_behind_others(self):
+        quest = QuestConfig('q', 'q', tasks=[
+            custom_task('a', self.recorder('a', [False])),
+            custom_task('b', self.recorder('b')),
+            custom_task('c', self.recorder('c')),
+        ])
+        self.manager.register_quest(quest)
+
+        self.assertTrue(self.manager.execute_quest('q'))
+        self.assertEqual(['a', 'b', 'c', 'a'], self.calls)
+        self.assertEqual(1, quest.tasks[0].retry_count)
+
+    def test_on_fail_fires_once(self):
+        on_fail = MagicMock()
+        quest = QuestConfig('q', 'q', tasks=[
+            custom_task('a', self.recorder('a', [False] * 10), max_retry=2, on_fail=on_fail),
+        ])
+        self.manager.register_quest(quest)
+
+        self.assertFalse(self.manager.execute_quest('q'))
+        self.assertEqual(3, len(self.calls))
+        on_fail.assert_called_once()
+        self.assertEqual(QuestStatus.FAILED, quest.tasks[0].status)
+
+    def test_dirty_tasks_reset_between_runs(self):
+        quest = QuestConfig('q', 'q', tasks=[
+            custom_task('a', self.recorder('a', [False, True, False, True])),
+            custom_task('b', self.recorder('b')),
+        ])
+        self.manager.register_quest(quest)
+
+        self.assertTrue(self.manager.execute_quest('q'))
+        self.assertEqual(1, quest.tasks[0].retry_count)
+
+        # 第二次执行前重试次数清零，否则这里会累计为2
+        self.assertTrue(self.manager.execute_quest('q'))
+        self.assertEqual(1, quest.tasks[0].retry_count)
+        self.assertEqual(QuestStatus.COMPLETED, quest.tasks[1].status)
+        self.assertEqual(['a', 'b', 'a', 'a', 'b', 'a'], self.calls)
+
+    def test_batch_abort_does_not_stop_other_quests(self):
+        failing = QuestConfig('failing', 'failing', priority=1, tasks=[
+            custom_task('x', self.recorder('x', [False]), max_retry=0),
+            custom_task('y', self.recorder('y')),
+        ])
+        healthy = QuestConfig('healthy', 'healthy', tasks=[
+            custom_task('z', self.recorder('z')),
+        ])
+        self.manager.register_quest(failing)
+        self.manager.register_quest(healthy)
+
+        self.assertFalse(self.manager.execute_quests(['failing', 'healthy']))
+        self.assertEqual(['x', 'z'], self.calls)
+        self.assertEqual(QuestStatus.PENDING, failing.tasks[1].status)
+        self.assertEqual(QuestStatus.COMPLETED, healthy.tasks[0].status)
+
+    def test_batch_history_deltas_per_quest(self):
+        first = QuestConfig('first', 'first', tasks=[
+            custom_task('a', self.recorder('a')),
+            custom_task('b', self.recorder('b')),
+        ])
+        second = QuestConfig('second', 'second', tasks=[
+            custom_task('c', self.recorder('c', [False]), max_retry=0),
+        ])
+        self.manager.register_quest(first)
+        self.manager.register_quest(second)
+
+        self.manager.execute_quests(['first', 'second'])
+        deltas = {record['quest_id']: record['statistics_delta'] for record in self.manager.quest_history}
+        self.assertEqual(2, deltas['first']['total_tasks'])
+        self.assertEqual(2, deltas['first']['completed_tasks'])
+        self.assertEqual(1, deltas['second']['total_tasks'])
+        self.assertEqual(1, deltas['second']['failed_tasks'])
+        self.assertEqual(0, deltas['second']['completed_tasks'])
+
+    def test_cancel_during_backoff(self):
+        on_fail = MagicMock()
+
+        def executor():
+            self.calls.append('a')
+            # 失败后进入退避等待，等待期间取消
+            threading.Timer(0.05, self.manager.stop_current_execution).start()
+            return False
+
+        quest = QuestConfig('q', 'q', tasks=[
+            custom_task('a', executor, max_retry=5, on_fail=on_fail),
+        ])
+        self.manager.register_quest(quest)
+
+        start = time.monotonic()
+        self.assertFalse(self.manager.execute_quest('q'))
+        self.assertLess(time.monotonic() - start, 0.2)
+        self.assertEqual(['a'], self.calls)
+        on_fail.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()